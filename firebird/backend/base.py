@@ -4,10 +4,13 @@ Firebird database backend for Django.
 Requires kinterbasdb: http://www.firebirdsql.org/index.php?op=devel&sub=python
 """
 import datetime
+import sys
+import time
 try:
     from decimal import Decimal
 except ImportError:
     from django.utils._decimal import Decimal
+from django.db.utils import DEFAULT_DB_ALIAS
 from django.utils.encoding import smart_str, smart_unicode
 
 try:
@@ -21,6 +24,7 @@ except ImportError, e:
 
 from django.db.backends import *
 
+import metrics
 from client import DatabaseClient
 from creation import DatabaseCreation
 from introspection import DatabaseIntrospection
@@ -32,9 +36,42 @@ DatabaseError = Database.DatabaseError
 IntegrityError = Database.IntegrityError
 OperationalError = Database.OperationalError
 
+class LockConflictError(OperationalError):
+    "A statement conflicted with a concurrent transaction, it may succeed if retried."
+
+class DeadlockError(LockConflictError):
+    pass
+
+class UpdateConflictError(LockConflictError):
+    pass
+
+def parse_error(e):
+    """
+    Splits a kinterbasdb error, formatted as "(-803, 'isc_dsql_execute: \\n ...')",
+    into the Firebird error number and the lines of its message.
+    """
+    text = str(e)
+    try:
+        err_no = int(text.split()[0].strip(',()'))
+        lines = text.split("'")[1].split('\\n')
+    except (ValueError, IndexError):
+        return None, [text]
+    return err_no, lines
+
+def get_conflict_error_class(err_no, message):
+    "Returns the LockConflictError subclass matching a Firebird error, if any."
+    message = message.lower()
+    if err_no == -913:
+        if 'update conflicts' in message:
+            return UpdateConflictError
+        return DeadlockError
+    if 'lock conflict' in message or 'lock time-out' in message:
+        return LockConflictError
+    return None
+
 class DatabaseFeatures(BaseDatabaseFeatures):
     can_return_id_from_insert = True
-    uses_savepoints = False
+    uses_savepoints = True
 
 class DatabaseOperations(BaseDatabaseOperations):
     compiler_module = "firebird.backend.compiler"
@@ -132,6 +169,9 @@ class DatabaseOperations(BaseDatabaseOperations):
     def savepoint_rollback_sql(self, sid):
         return "ROLLBACK TO " + self.quote_name(sid)
 
+    def savepoint_commit_sql(self, sid):
+        return "RELEASE SAVEPOINT " + self.quote_name(sid)
+
     def get_generator_name(self, table_name):
         return '%s_GN' % util.truncate_name(table_name, self.max_name_length() - 3).upper()
 
@@ -146,6 +186,9 @@ class TypeTranslator(object):
     db_charset_code = None
     charset = None
     
+    def __init__(self, alias=DEFAULT_DB_ALIAS):
+        self.alias = alias
+    
     def set_charset(self, db_charset):
         self.db_charset_code = DB_CHARSET_TO_DB_CHARSET_CODE[db_charset]
         self.charset = DB_CHARSET_TO_PYTHON_CHARSET[db_charset]
@@ -217,6 +260,8 @@ class TypeTranslator(object):
         return typeconv_tu.unicode_conv_out((text, self.db_charset_code))
 
     def out_blob(self, text):
+        if text is not None:
+            metrics.blob_bytes_decoded.inc((self.alias,), len(text))
         return typeconv_tu.unicode_conv_out((text, self.db_charset_code))
 
 class DatabaseWrapper(BaseDatabaseWrapper):
@@ -240,7 +285,7 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
         
         self._server_version = None
-        self._type_translator = TypeTranslator()
+        self._type_translator = TypeTranslator(self.alias)
         
         self.features = DatabaseFeatures()
         self.ops = DatabaseOperations()
@@ -249,28 +294,33 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         self.introspection = DatabaseIntrospection(self)
         self.validation = DatabaseValidation(self)
 
+    def _get_connection_params(self):
+        settings_dict = self.settings_dict
+        if settings_dict['NAME'] == '':
+            from django.core.exceptions import ImproperlyConfigured
+            raise ImproperlyConfigured("You need to specify DATABASE_NAME in your Django settings file.")
+        conn_params = {
+            'charset': 'UNICODE_FSS'
+        }
+        conn_params['dsn'] = settings_dict['NAME']
+        if settings_dict['HOST']:
+            conn_params['dsn'] = ('%s:%s') % (settings_dict['HOST'], conn_params['dsn'])
+        if settings_dict['PORT']:
+            conn_params['port'] = settings_dict['PORT']
+        if settings_dict['USER']:
+            conn_params['user'] = settings_dict['USER']
+        if settings_dict['PASSWORD']:
+            conn_params['password'] = settings_dict['PASSWORD']
+        conn_params.update(settings_dict['OPTIONS'])
+        return conn_params
+
     def _cursor(self):
         if self.connection is None:
-            settings_dict = self.settings_dict
-            if settings_dict['NAME'] == '':
-                from django.core.exceptions import ImproperlyConfigured
-                raise ImproperlyConfigured("You need to specify DATABASE_NAME in your Django settings file.")
-            conn_params = {
-                'charset': 'UNICODE_FSS'
-            }
-            conn_params['dsn'] = settings_dict['NAME']
-            if settings_dict['HOST']:
-                conn_params['dsn'] = ('%s:%s') % (settings_dict['HOST'], conn_params['dsn'])
-            if settings_dict['PORT']:
-                conn_params['port'] = settings_dict['PORT']
-            if settings_dict['USER']:
-                conn_params['user'] = settings_dict['USER']
-            if settings_dict['PASSWORD']:
-                conn_params['password'] = settings_dict['PASSWORD']
-            conn_params.update(settings_dict['OPTIONS'])
-            self.connection = Database.connect(**conn_params)
+            start = time.time()
+            self.connection = Database.connect(**self._get_connection_params())
+            metrics.connect_seconds.observe((self.alias,), time.time() - start)
             self._type_translator.set_charset(self.connection.charset)
-        return FirebirdCursorWrapper(self.connection.cursor(), self._type_translator)
+        return FirebirdCursorWrapper(self.connection.cursor(), self._type_translator, self.alias)
     
     def get_server_version(self):
         if not self._server_version:
@@ -288,34 +338,94 @@ class FirebirdCursorWrapper(object):
     We need to do some data translation too.
     See: http://kinterbasdb.sourceforge.net/dist_docs/usage.html for Dynamic Type Translation
     """
+    # Callables called with (cursor_wrapper, query) after every successful
+    # statement, see firebird.plans.
+    statement_observers = []
     
-    def __init__(self, cursor, type_translator):
+    def __init__(self, cursor, type_translator, alias=DEFAULT_DB_ALIAS):
         self.cursor = cursor
+        self.alias = alias
+        self.type_translator = type_translator
         self.cursor.set_type_trans_in(type_translator.type_translate_in)
         self.cursor.set_type_trans_out(type_translator.type_translate_out)
     
     def execute(self, query, params=()):
         cquery = self.convert_query(query, len(params))
+        start = time.time()
         try:
-            return self.cursor.execute(cquery, params)
-        except Database.ProgrammingError, e:
-            err_no = int(str(e).split()[0].strip(',()'))
-            output = ["Execute query error. FB error No. %i" % err_no]
-            output.extend(str(e).split("'")[1].split('\\n'))
-            output.append("Query:")
-            output.append(cquery)
-            output.append("Parameters:")
-            output.append(str(params))
-            if err_no in (-803,):
-                raise IntegrityError("\n".join(output))
-            raise DatabaseError("\n".join(output))
+            result = self.cursor.execute(cquery, params)
+        except Database.DatabaseError:
+            self.raise_error(sys.exc_info(), cquery, params)
+        metrics.statement_seconds.observe((self.alias,), time.time() - start)
+        metrics.statements.inc((self.alias, 'execute'))
+        if self.statement_observers:
+            self.notify_observers(cquery)
+        return result
 
     def executemany(self, query, param_list):
         try:
             query = self.convert_query(query, len(param_list[0]))
-            return self.cursor.executemany(query, param_list)
         except (IndexError,TypeError):
             return None
+        start = time.time()
+        try:
+            result = self.cursor.executemany(query, param_list)
+        except Database.DatabaseError:
+            self.raise_error(sys.exc_info(), query,
+                '%d rows, the first being %s' % (len(param_list), param_list[0]))
+        metrics.statement_seconds.observe((self.alias,), time.time() - start)
+        metrics.statements.inc((self.alias, 'executemany'))
+        if self.statement_observers:
+            self.notify_observers(query)
+        return result
+
+    def raise_error(self, exc_info, query, params):
+        """
+        Raises the error of a failed statement again, with the query added to
+        the message and, for conflicts with other transactions, as a
+        LockConflictError subclass.
+        """
+        e = exc_info[1]
+        err_no, lines = parse_error(e)
+        if err_no is not None:
+            metrics.statement_errors.inc((self.alias, err_no))
+        error_class = get_conflict_error_class(err_no, '\n'.join(lines))
+        if error_class is None:
+            if not isinstance(e, Database.ProgrammingError):
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if err_no in (-803,):
+                error_class = IntegrityError
+            else:
+                error_class = DatabaseError
+        output = ["Execute query error. FB error No. %s" % err_no]
+        output.extend(lines)
+        output.append("Query:")
+        output.append(query)
+        output.append("Parameters:")
+        output.append(str(params))
+        raise error_class("\n".join(output))
+
+    def notify_observers(self, query):
+        for observer in list(self.statement_observers):
+            observer(self, query)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            metrics.rows_fetched.inc((self.alias,))
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        if rows:
+            metrics.rows_fetched.inc((self.alias,), len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        if rows:
+            metrics.rows_fetched.inc((self.alias,), len(rows))
+        return rows
 
     def convert_query(self, query, num_params):
         return query % tuple("?" * num_params)
@@ -327,6 +437,14 @@ class FirebirdCursorWrapper(object):
             return getattr(self.cursor, attr)
 
     def __iter__(self):
-        return iter(self.cursor)
+        # Counted once at the end, not to take the metric lock for every row
+        count = 0
+        try:
+            for row in self.cursor:
+                count += 1
+                yield row
+        finally:
+            if count:
+                metrics.rows_fetched.inc((self.alias,), count)
 
 
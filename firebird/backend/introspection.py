@@ -128,3 +128,102 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
                 'unique': (r[1].strip() == 'UNIQUE')
             }
         return indexes
+
+    def get_triggers(self, cursor, table_name):
+        "Returns the names of the active user triggers of the given table."
+        tbl_name = "'%s'" % table_name
+        cursor.execute("""
+            select
+              rdb$trigger_name
+            from
+              rdb$triggers
+            where
+              rdb$relation_name = %s
+              and coalesce(rdb$system_flag, 0) = 0
+              and coalesce(rdb$trigger_inactive, 0) = 0
+            order by
+              rdb$trigger_name""" % (tbl_name,))
+        return [r[0].strip() for r in cursor.fetchall()]
+
+    def get_plain_indexes(self, cursor, table_name):
+        """
+        Returns the names of the active indexes of the given table that do not
+        enforce a constraint, which are the only ones Firebird lets us
+        deactivate.
+        """
+        tbl_name = "'%s'" % table_name
+        cursor.execute("""
+            select
+              i.rdb$index_name
+            from
+              rdb$indices i
+            where
+              i.rdb$relation_name = %s
+              and coalesce(i.rdb$system_flag, 0) = 0
+              and coalesce(i.rdb$index_inactive, 0) = 0
+              and not exists (
+                select
+                  1
+                from
+                  rdb$relation_constraints con
+                where
+                  con.rdb$index_name = i.rdb$index_name
+              )
+            order by
+              i.rdb$index_name""" % (tbl_name,))
+        return [r[0].strip() for r in cursor.fetchall()]
+
+    def get_computed_columns(self, cursor, table_name):
+        "Returns the names of the COMPUTED BY columns of the given table."
+        tbl_name = "'%s'" % table_name
+        cursor.execute("""
+            select
+              rf.rdb$field_name
+            from
+              rdb$relation_fields rf join rdb$fields f on (rf.rdb$field_source = f.rdb$field_name)
+            where
+              rf.rdb$relation_name = %s
+              and f.rdb$computed_blr is not null
+            order by
+              rf.rdb$field_position""" % (tbl_name,))
+        return [r[0].strip() for r in cursor.fetchall()]
+
+    def get_foreign_keys(self, cursor, table_name):
+        """
+        Returns the foreign key constraints of the given table as a list of
+        (constraint_name, columns, other_table, other_columns, update_rule,
+        delete_rule) tuples, the rules being None for the default behaviour.
+        """
+        tbl_name = "'%s'" % table_name
+        cursor.execute("""
+            select
+              rc1.rdb$constraint_name
+              , is1.rdb$field_name
+              , rc2.rdb$relation_name
+              , is2.rdb$field_name
+              , ref.rdb$update_rule
+              , ref.rdb$delete_rule
+            from
+              rdb$relation_constraints rc1
+              join rdb$ref_constraints ref on (rc1.rdb$constraint_name = ref.rdb$constraint_name)
+              join rdb$relation_constraints rc2 on (ref.rdb$const_name_uq = rc2.rdb$constraint_name)
+              join rdb$index_segments is1 on (rc1.rdb$index_name = is1.rdb$index_name)
+              join rdb$index_segments is2 on (rc2.rdb$index_name = is2.rdb$index_name
+                and is1.rdb$field_position = is2.rdb$field_position)
+            where
+              rc1.rdb$relation_name = %s
+              and rc1.rdb$constraint_type = 'FOREIGN KEY'
+            order by
+              rc1.rdb$constraint_name
+              , is1.rdb$field_position""" % (tbl_name,))
+        foreign_keys = []
+        for r in cursor.fetchall():
+            name = r[0].strip()
+            if not foreign_keys or foreign_keys[-1][0] != name:
+                # RESTRICT is what Firebird records when no rule was given
+                rules = [rule and rule.strip() for rule in r[4:6]]
+                rules = [rule not in (None, 'RESTRICT') and rule or None for rule in rules]
+                foreign_keys.append((name, [], r[2].strip(), [], rules[0], rules[1]))
+            foreign_keys[-1][1].append(r[1].strip())
+            foreign_keys[-1][3].append(r[3].strip())
+        return foreign_keys
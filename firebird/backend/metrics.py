@@ -0,0 +1,204 @@
+"""
+Runtime metrics of the Firebird backend.
+
+The backend updates the counters and histograms of the module level
+``registry``, every sample labelled with the database alias. They can be read
+as a Python structure or in the Prometheus text exposition format:
+
+    from firebird.backend import metrics
+
+    metrics.registry.snapshot()
+    metrics.TextExporter().export(metrics.registry)
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        "Returns a list of (labels tuple, value), sorted by labels."
+        self._lock.acquire()
+        try:
+            items = [(labels, self._copy(value)) for labels, value in self._values.items()]
+        finally:
+            self._lock.release()
+        items.sort()
+        return items
+
+    def _copy(self, value):
+        return value
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._values.clear()
+        finally:
+            self._lock.release()
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels, amount=1):
+        "Adds ``amount`` to the sample of ``labels``, a tuple of label values."
+        self._lock.acquire()
+        try:
+            self._values[labels] = self._values.get(labels, 0) + amount
+        finally:
+            self._lock.release()
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        self._lock.acquire()
+        try:
+            sample = self._values.get(labels)
+            if sample is None:
+                # Per bucket counts (the last one is +Inf), sum, count
+                sample = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+        finally:
+            self._lock.release()
+
+    def _copy(self, value):
+        counts, total, count = value
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args):
+        self._lock.acquire()
+        try:
+            if name not in self._by_name:
+                metric = metric_class(name, *args)
+                self._metrics.append(metric)
+                self._by_name[name] = metric
+            return self._by_name[name]
+        finally:
+            self._lock.release()
+
+    def counter(self, name, help, labelnames=('alias',)):
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=('alias',), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def metrics(self):
+        return list(self._metrics)
+
+    def snapshot(self):
+        """
+        Returns {name: {'type', 'help', 'samples'}}, samples being a list of
+        {'labels': {name: value}, 'value': value} dicts. Histogram values are
+        {'buckets': [(upper bound, cumulative count)], 'sum', 'count'}.
+        """
+        snapshot = {}
+        for metric in self.metrics():
+            snapshot[metric.name] = {
+                'type': metric.type,
+                'help': metric.help,
+                'samples': [{'labels': dict(zip(metric.labelnames, labels)), 'value': value}
+                    for labels, value in metric.samples()],
+            }
+        return snapshot
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+class Exporter(object):
+    "Turns the content of a Registry into some output format."
+    def export(self, registry):
+        raise NotImplementedError
+
+class SnapshotExporter(Exporter):
+    def export(self, registry):
+        return registry.snapshot()
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (name, _escape(value)) for name, value in pairs])
+
+def _format_value(value):
+    # repr() of a long ends with an L on Python 2
+    if isinstance(value, (int, long)):
+        return '%d' % value
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+class TextExporter(Exporter):
+    "Prometheus text exposition format."
+    def export(self, registry):
+        lines = []
+        for metric in registry.metrics():
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for labels, value in metric.samples():
+                pairs = zip(metric.labelnames, labels)
+                if metric.type == 'histogram':
+                    for bound, count in value['buckets']:
+                        lines.append('%s_bucket%s %d' % (metric.name,
+                            _format_labels(pairs + [('le', _format_value(bound))]), count))
+                    lines.append('%s_sum%s %s' % (metric.name, _format_labels(pairs),
+                        _format_value(value['sum'])))
+                    lines.append('%s_count%s %d' % (metric.name, _format_labels(pairs),
+                        value['count']))
+                else:
+                    lines.append('%s%s %s' % (metric.name, _format_labels(pairs),
+                        _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+statements = registry.counter('firebird_statements_total',
+    'Statements executed.', ('alias', 'method'))
+statement_errors = registry.counter('firebird_statement_errors_total',
+    'Failed statements by Firebird error number.', ('alias', 'error'))
+statement_seconds = registry.histogram('firebird_statement_seconds',
+    'Time spent executing statements.')
+connect_seconds = registry.histogram('firebird_connect_seconds',
+    'Time spent opening database attachments.')
+rows_fetched = registry.counter('firebird_rows_fetched_total',
+    'Rows fetched from cursors.')
+blob_bytes_decoded = registry.counter('firebird_blob_bytes_decoded_total',
+    'Bytes of text BLOB decoded.')
+events_received = registry.counter('firebird_events_received_total',
+    'Posted events received by the postevents command.', ('alias', 'event'))
+event_dispatch_seconds = registry.histogram('firebird_event_dispatch_seconds',
+    'Time spent running post event processors.', ('alias', 'event'))
+event_errors = registry.counter('firebird_event_errors_total',
+    'Post event batches whose processing failed.')
+conflict_retries = registry.counter('firebird_conflict_retries_total',
+    'Statement blocks rolled back and retried after a conflict.',
+    ('alias', 'error'))
@@ -0,0 +1,404 @@
+"""
+A stand-in for the kinterbasdb module that replays recorded result sets.
+
+It does just enough for firebird.backend to run without a Firebird server:
+statements are looked up by their text in a set of Recording objects, and
+fetched values go through the dynamic type translators exactly like
+kinterbasdb calls them, so decoding costs are measured for real.
+
+The raw values follow kinterbasdb 3.2 and 3.3, the versions the backend is
+used with, as documented in their typeconv_datetime_stdlib module: DATE is
+(y, m, d), TIME (h, mi, s, microsecond) and TIMESTAMP (y, m, d, h, mi, s,
+microsecond). They were not recorded from a server, so check timings that
+depend on them with run.py --embedded.
+
+install() must run before firebird.backend.base is imported.
+"""
+import datetime
+import sys
+import types
+from decimal import Decimal
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+class Error(StandardError):
+    pass
+
+class Warning(StandardError):
+    pass
+
+class InterfaceError(Error):
+    pass
+
+class DatabaseError(Error):
+    pass
+
+class DataError(DatabaseError):
+    pass
+
+class OperationalError(DatabaseError):
+    pass
+
+class IntegrityError(DatabaseError):
+    pass
+
+class InternalError(DatabaseError):
+    pass
+
+class ProgrammingError(DatabaseError):
+    pass
+
+class NotSupportedError(DatabaseError):
+    pass
+
+isc_tpb_read = '\x08'
+isc_tpb_write = '\x09'
+isc_tpb_read_committed = '\x0f'
+isc_tpb_rec_version = '\x11'
+
+# Python types reported in cursor.description for each translator key
+TYPE_CODES = {
+    'INTEGER': int,
+    'FLOAT': float,
+    'FIXED': Decimal,
+    'DATE': datetime.date,
+    'TIME': datetime.time,
+    'TIMESTAMP': datetime.datetime,
+    'TEXT': str,
+    'TEXT_UNICODE': unicode,
+    'BLOB': str,
+}
+
+# Raw values that kinterbasdb hands to the translators as tuples
+_TUPLE_KINDS = ('DATE', 'TIME', 'TIMESTAMP')
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+class Recording(object):
+    """
+    The result of one statement. ``columns`` is a list of (name, kind, scale)
+    where kind is a type translator key ('INTEGER' and 'FLOAT' have none), and
+    ``rows`` hold the raw values kinterbasdb would pass to the translators:
+    scaled integers for FIXED, tuples for dates and times, byte strings for
+    text. ``param_types`` lists the (kind, scale) of each input parameter.
+    """
+    def __init__(self, sql, columns=(), rows=(), param_types=()):
+        self.sql = normalize(sql)
+        self.columns = [tuple(column) for column in columns]
+        self.rows = rows
+        self.param_types = [tuple(param) for param in param_types]
+
+    def description(self):
+        return tuple([(name, TYPE_CODES[kind], 0, 0, 0, -scale, True)
+            for (name, kind, scale) in self.columns])
+
+    def to_dict(self):
+        return {'sql': self.sql, 'columns': self.columns, 'rows': self.rows,
+            'param_types': self.param_types}
+
+    def from_dict(cls, data):
+        kinds = [column[1] for column in data['columns']]
+        rows = []
+        for row in data['rows']:
+            rows.append(tuple([kind in _TUPLE_KINDS and value is not None and tuple(value) or value
+                for kind, value in zip(kinds, row)]))
+        return cls(data['sql'], data['columns'], rows, data.get('param_types', ()))
+    from_dict = classmethod(from_dict)
+
+def load_recordings(path):
+    stream = open(path)
+    try:
+        return [Recording.from_dict(data) for data in json.load(stream)]
+    finally:
+        stream.close()
+
+def save_recordings(path, recordings):
+    stream = open(path, 'w')
+    try:
+        json.dump([recording.to_dict() for recording in recordings], stream)
+    finally:
+        stream.close()
+
+class PreparedStatement(object):
+    def __init__(self, sql, plan):
+        self.sql = sql
+        self.plan = plan
+
+class Cursor(object):
+    arraysize = 1
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+        self._position = 0
+        self._converters = []
+        self._trans_in = {}
+        self._trans_out = {}
+
+    def set_type_trans_in(self, trans_dict):
+        self._trans_in = trans_dict
+
+    def set_type_trans_out(self, trans_dict):
+        self._trans_out = trans_dict
+
+    def _converter(self, kind, scale):
+        charset_id = self.connection.charset_id
+        conv = self._trans_out.get(kind)
+        if conv is None:
+            return None
+        if kind == 'FIXED':
+            return lambda value: conv((value, -scale))
+        if kind == 'TEXT_UNICODE':
+            return lambda value: conv((value, charset_id))
+        return conv
+
+    def _convert_params(self, recording, params):
+        if not recording.param_types:
+            return params
+        charset_id = self.connection.charset_id
+        converted = []
+        for (kind, scale), value in zip(recording.param_types, params):
+            conv = self._trans_in.get(kind)
+            if conv is not None:
+                if kind == 'FIXED':
+                    value = conv((value, -scale))
+                elif kind == 'TEXT_UNICODE':
+                    value = conv((value, charset_id))
+                else:
+                    value = conv(value)
+            converted.append(value)
+        return converted
+
+    def prep(self, sql):
+        plan = self.connection.plans.get(normalize(sql))
+        if plan is None:
+            raise ProgrammingError('(-104, \'isc_dsql_prepare: \\n  Dynamic SQL Error\\n  '
+                'No recorded plan for statement\\n  %s\')' % normalize(sql))
+        if isinstance(plan, Exception):
+            raise plan
+        return PreparedStatement(sql, plan)
+
+    def execute(self, sql, params=()):
+        if self.connection.statements is not None:
+            self.connection.statements.append(normalize(sql))
+        if normalize(sql) in self.connection.errors:
+            raise self.connection.errors[normalize(sql)]
+        recording = self.connection.recordings.get(normalize(sql))
+        if recording is None:
+            if sql.lstrip()[:6].upper() == 'SELECT':
+                raise ProgrammingError('(-204, \'isc_dsql_prepare: \\n  Dynamic SQL Error\\n  '
+                    'No recorded result for statement\\n  %s\')' % normalize(sql))
+            self.description = None
+            self._rows = []
+            self.rowcount = 0
+            return
+        self._convert_params(recording, params)
+        self.description = recording.description()
+        self._rows = recording.rows
+        self._position = 0
+        self.rowcount = len(recording.rows)
+        self._converters = [self._converter(kind, scale) for (name, kind, scale) in recording.columns]
+
+    def executemany(self, sql, seq_of_params):
+        if self.connection.statements is not None:
+            self.connection.statements.append(normalize(sql))
+        if normalize(sql) in self.connection.errors:
+            raise self.connection.errors[normalize(sql)]
+        recording = self.connection.recordings.get(normalize(sql))
+        for params in seq_of_params:
+            if recording is not None:
+                self._convert_params(recording, params)
+
+    def _convert(self, row):
+        converted = []
+        for conv, value in zip(self._converters, row):
+            if conv is not None:
+                value = conv(value)
+            converted.append(value)
+        return tuple(converted)
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return self._convert(row)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        if self.connection.fetches is not None:
+            self.connection.fetches.append(size)
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return [self._convert(row) for row in rows]
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return [self._convert(row) for row in rows]
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        pass
+
+class Connection(object):
+    """
+    A connection serving ``recordings``, a dict of Recording by statement.
+
+    For tests: ``plans`` maps statements to the plan returned by
+    Cursor.prep(), or to an exception it raises, and ``errors`` maps
+    statements to an exception execute() raises. With ``log`` true the
+    statements executed, commits and rollbacks are appended to
+    ``statements`` and the sizes passed to fetchmany() to ``fetches``.
+    """
+    server_version = 'WI-V2.5.9.27139 Firebird 2.5'
+
+    def __init__(self, recordings, charset='UNICODE_FSS', plans=None, errors=None, log=False):
+        self.recordings = recordings
+        self.charset = charset
+        self.charset_id = DB_CHAR_SET_NAME_TO_DB_CHAR_SET_ID_MAP[charset]
+        self.default_tpb = isc_tpb_write
+        self.plans = plans or {}
+        self.errors = errors or {}
+        self.statements = self.fetches = None
+        if log:
+            self.statements = []
+            self.fetches = []
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        if self.statements is not None:
+            self.statements.append('COMMIT')
+
+    def rollback(self):
+        if self.statements is not None:
+            self.statements.append('ROLLBACK')
+
+    def close(self):
+        pass
+
+# typeconv_datetime_stdlib
+
+def date_conv_in(value):
+    if value is None or isinstance(value, basestring):
+        return value
+    return (value.year, value.month, value.day)
+
+def time_conv_in(value):
+    if value is None or isinstance(value, basestring):
+        return value
+    return (value.hour, value.minute, value.second, value.microsecond)
+
+def timestamp_conv_in(value):
+    if value is None or isinstance(value, basestring):
+        return value
+    return (value.year, value.month, value.day, value.hour, value.minute,
+        value.second, value.microsecond)
+
+def date_conv_out(date_tuple):
+    if date_tuple is None:
+        return None
+    return datetime.date(*date_tuple)
+
+def time_conv_out(time_tuple):
+    if time_tuple is None:
+        return None
+    return datetime.time(*time_tuple)
+
+def timestamp_conv_out(timestamp_tuple):
+    if timestamp_tuple is None:
+        return None
+    return datetime.datetime(*timestamp_tuple)
+
+# typeconv_fixed_decimal
+
+def fixed_conv_in_precise(fixed):
+    (value, scale) = fixed
+    if value is None:
+        return None
+    return int(Decimal(value).scaleb(-scale))
+
+def fixed_conv_out_precise(fixed):
+    (value, scale) = fixed
+    if value is None:
+        return None
+    return Decimal(value).scaleb(scale)
+
+# typeconv_text_unicode
+
+DB_CHAR_SET_NAME_TO_DB_CHAR_SET_ID_MAP = {'NONE': 0, 'OCTETS': 1, 'ASCII': 2,
+    'UNICODE_FSS': 3, 'UTF8': 4, 'ISO8859_1': 21, 'WIN1252': 53}
+DB_CHAR_SET_NAME_TO_PYTHON_ENCODING_MAP = {'NONE': None, 'OCTETS': None, 'ASCII': 'ascii',
+    'UNICODE_FSS': 'utf_8', 'UTF8': 'utf_8', 'ISO8859_1': 'iso8859_1', 'WIN1252': 'cp1252'}
+_CHAR_SET_ID_TO_PYTHON_ENCODING = dict([(DB_CHAR_SET_NAME_TO_DB_CHAR_SET_ID_MAP[name], encoding)
+    for name, encoding in DB_CHAR_SET_NAME_TO_PYTHON_ENCODING_MAP.items()])
+
+def unicode_conv_in(text):
+    (value, charset_id) = text
+    if value is None:
+        return None
+    return value.encode(_CHAR_SET_ID_TO_PYTHON_ENCODING[charset_id] or 'ascii')
+
+def unicode_conv_out(text):
+    (value, charset_id) = text
+    if value is None:
+        return None
+    return value.decode(_CHAR_SET_ID_TO_PYTHON_ENCODING[charset_id] or 'ascii')
+
+def _module(name, attrs):
+    module = types.ModuleType(name)
+    for attr in attrs:
+        setattr(module, attr, globals()[attr])
+    return module
+
+def install(recordings):
+    """
+    Registers a fake kinterbasdb package serving ``recordings`` in
+    sys.modules and returns it.
+    """
+    registry = dict([(recording.sql, recording) for recording in recordings])
+    kinterbasdb = _module('kinterbasdb', ['Error', 'Warning', 'InterfaceError',
+        'DatabaseError', 'DataError', 'OperationalError', 'IntegrityError',
+        'InternalError', 'ProgrammingError', 'NotSupportedError',
+        'isc_tpb_read', 'isc_tpb_write', 'isc_tpb_read_committed', 'isc_tpb_rec_version'])
+    kinterbasdb.recordings = registry
+    kinterbasdb.connect = lambda **params: Connection(registry, params.get('charset', 'UNICODE_FSS'))
+    kinterbasdb.typeconv_datetime_stdlib = _module('kinterbasdb.typeconv_datetime_stdlib',
+        ['date_conv_in', 'time_conv_in', 'timestamp_conv_in',
+         'date_conv_out', 'time_conv_out', 'timestamp_conv_out'])
+    kinterbasdb.typeconv_fixed_decimal = _module('kinterbasdb.typeconv_fixed_decimal',
+        ['fixed_conv_in_precise', 'fixed_conv_out_precise'])
+    kinterbasdb.typeconv_text_unicode = _module('kinterbasdb.typeconv_text_unicode',
+        ['DB_CHAR_SET_NAME_TO_DB_CHAR_SET_ID_MAP', 'DB_CHAR_SET_NAME_TO_PYTHON_ENCODING_MAP',
+         'unicode_conv_in', 'unicode_conv_out'])
+    sys.modules['kinterbasdb'] = kinterbasdb
+    for name in ('typeconv_datetime_stdlib', 'typeconv_fixed_decimal', 'typeconv_text_unicode'):
+        sys.modules['kinterbasdb.' + name] = getattr(kinterbasdb, name)
+    return kinterbasdb
+
+def capture_statements(func):
+    """
+    Calls ``func`` with a cursor that records the statements executed on it
+    and returns no rows. Returns the list of statements, handy to build
+    recordings for queries whose text is generated by the backend.
+    """
+    statements = []
+    class CaptureCursor(Cursor):
+        def execute(self, sql, params=()):
+            statements.append(sql)
+            self.description = ()
+            self._rows = []
+            self._position = 0
+    func(CaptureCursor(Connection({})))
+    return statements
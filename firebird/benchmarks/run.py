@@ -0,0 +1,178 @@
+"""
+Runs the backend benchmarks and writes the timings as JSON.
+
+Without a server (the default) kinterbasdb is replaced by the recording
+replaying fake of firebird.benchmarks.fakedb. --embedded runs the same
+benchmarks against a real database file through kinterbasdb, creating and
+dropping a BENCH_ROWS table in it.
+
+    python -m firebird.benchmarks.run --output before.json
+    python -m firebird.benchmarks.run --compare before.json
+
+--compare exits with status 1 when a benchmark got slower than the baseline
+by more than --tolerance.
+"""
+import platform
+import sys
+import time
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+if sys.platform == 'win32':
+    timer = time.clock
+else:
+    timer = time.time
+
+def configure(options):
+    from django.conf import settings
+    database = {
+        'ENGINE': 'firebird.backend',
+        'NAME': options.embedded or 'bench.fdb',
+        'HOST': '',
+        'PORT': '',
+        'USER': options.user,
+        'PASSWORD': options.password,
+        'OPTIONS': {},
+    }
+    settings.configure(DEBUG=False, DATABASES={'default': database},
+        INSTALLED_APPS=('firebird',))
+    if not options.embedded:
+        from firebird.benchmarks import fakedb
+        kinterbasdb = fakedb.install([])
+        from firebird.benchmarks import suite
+        recordings = suite.get_recordings(options.rows)
+        if options.recordings:
+            recordings.extend(fakedb.load_recordings(options.recordings))
+        for recording in recordings:
+            kinterbasdb.recordings[recording.sql] = recording
+
+def measure(benchmark, repeat, min_time):
+    """
+    Times benchmark.run() like timeit: the number of calls per sample grows
+    until a sample lasts ``min_time`` seconds, then the best and mean of
+    ``repeat`` samples are kept.
+    """
+    number = 1
+    while True:
+        start = timer()
+        for i in xrange(number):
+            benchmark.run()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 10
+    samples = [elapsed]
+    for i in range(repeat - 1):
+        start = timer()
+        for j in xrange(number):
+            benchmark.run()
+        samples.append(timer() - start)
+    best = min(samples) / number
+    return {
+        'ops': benchmark.ops,
+        'number': number,
+        'repeat': repeat,
+        'best': best,
+        'mean': sum(samples) / len(samples) / number,
+        'per_op_us': best / benchmark.ops * 1000000,
+        'ops_per_sec': benchmark.ops / best,
+    }
+
+def run(options, names):
+    from django import get_version
+    from firebird.benchmarks import suite
+
+    if options.embedded:
+        suite.create_table(options.rows)
+    results = {}
+    try:
+        for benchmark_class in suite.BENCHMARKS:
+            if names and benchmark_class.name not in names:
+                continue
+            benchmark = benchmark_class(options.rows)
+            benchmark.setup()
+            try:
+                results[benchmark.name] = measure(benchmark, options.repeat, options.min_time)
+            finally:
+                benchmark.teardown()
+            sys.stderr.write('%-20s %12.3f us/op\n' % (benchmark.name,
+                results[benchmark.name]['per_op_us']))
+    finally:
+        if options.embedded:
+            suite.drop_table()
+    return {
+        'mode': options.embedded and 'embedded' or 'fake',
+        'rows': options.rows,
+        'python': platform.python_version(),
+        'django': get_version(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks': results,
+    }
+
+def compare(report, baseline, tolerance):
+    "Prints the changes against ``baseline``, returns the regressed benchmarks."
+    if report['mode'] != baseline['mode'] or report['rows'] != baseline['rows']:
+        sys.stderr.write('Warning: the baseline was run with mode=%s rows=%s\n' % (
+            baseline['mode'], baseline['rows']))
+    regressions = []
+    for name, result in sorted(report['benchmarks'].items()):
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name]['per_op_us']
+        ratio = result['per_op_us'] / before
+        sys.stderr.write('%-20s %12.3f -> %12.3f us/op  %+6.1f%%\n' % (name, before,
+            result['per_op_us'], (ratio - 1) * 100))
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option('--embedded', dest='embedded', metavar='PATH',
+        help='Run against the Firebird database at PATH instead of the fake driver.')
+    parser.add_option('--user', dest='user', default='SYSDBA')
+    parser.add_option('--password', dest='password', default='masterkey')
+    parser.add_option('--rows', dest='rows', type='int', default=10000,
+        help='Rows in the benchmark table (default 10000).')
+    parser.add_option('--repeat', dest='repeat', type='int', default=5)
+    parser.add_option('--min-time', dest='min_time', type='float', default=0.2,
+        help='Minimum duration of a sample in seconds.')
+    parser.add_option('--recordings', dest='recordings', metavar='FILE',
+        help='Extra JSON recordings for the fake driver.')
+    parser.add_option('--output', dest='output', metavar='FILE',
+        help='Write the JSON report to FILE instead of stdout.')
+    parser.add_option('--compare', dest='compare', metavar='FILE',
+        help='Compare with a previous JSON report.')
+    parser.add_option('--tolerance', dest='tolerance', type='float', default=0.1,
+        help='Allowed slowdown for --compare (default 0.1, i.e. 10%).')
+    options, names = parser.parse_args(argv)
+
+    configure(options)
+    report = run(options, names)
+    if options.output:
+        stream = open(options.output, 'w')
+        try:
+            json.dump(report, stream, indent=2, sort_keys=True)
+        finally:
+            stream.close()
+    elif not options.compare:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    if options.compare:
+        stream = open(options.compare)
+        try:
+            baseline = json.load(stream)
+        finally:
+            stream.close()
+        regressions = compare(report, baseline, options.tolerance)
+        if regressions:
+            sys.stderr.write('Slower than the baseline: %s\n' % ', '.join(regressions))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
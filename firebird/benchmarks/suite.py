@@ -0,0 +1,221 @@
+"""
+The benchmarks run by firebird.benchmarks.run.
+
+Importing this module needs configured settings and, without a server, the
+fake kinterbasdb installed by fakedb.install(). Every benchmark works on the
+BENCH_ROWS table, which exists for real in embedded mode and only as
+recordings (see get_recordings) otherwise.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import connection, models
+
+from firebird.benchmarks import fakedb
+
+TABLE = 'BENCH_ROWS'
+COLUMNS = ('ID', 'NAME', 'AMOUNT', 'CREATED', 'DAY', 'NOTE')
+# (translator key, scale) of each column
+COLUMN_TYPES = (('INTEGER', 0), ('TEXT_UNICODE', 0), ('FIXED', 4), ('TIMESTAMP', 0),
+    ('DATE', 0), ('BLOB', 0))
+CREATE_TABLE = """
+    CREATE TABLE BENCH_ROWS (
+        ID INTEGER NOT NULL PRIMARY KEY,
+        NAME VARCHAR(100),
+        AMOUNT NUMERIC(18, 4),
+        CREATED TIMESTAMP,
+        DAY DATE,
+        NOTE BLOB SUB_TYPE 1
+    )"""
+
+SELECT_ROWS = 'SELECT %s FROM "%s"' % (', '.join(['"%s"' % c for c in COLUMNS]), TABLE)
+INSERT_ROWS = 'INSERT INTO "%s" (%s) VALUES (%s)' % (TABLE,
+    ', '.join(['"%s"' % c for c in COLUMNS]), ', '.join(['%s'] * len(COLUMNS)))
+
+class BenchRow(models.Model):
+    name = models.CharField(max_length=100)
+    amount = models.DecimalField(max_digits=18, decimal_places=4)
+    created = models.DateTimeField()
+    day = models.DateField()
+    note = models.TextField()
+
+    class Meta:
+        app_label = 'firebird'
+        db_table = TABLE
+
+def make_row(i):
+    "Python values of the i-th row of BENCH_ROWS."
+    return (i, u'name %d \xe9' % i, Decimal(i * 12345).scaleb(-4),
+        datetime.datetime(2020, 1, 1 + i % 28, i % 24, i % 60, i % 60, 500000),
+        datetime.date(2020, 1 + i % 12, 1 + i % 28), u'note %d' % i)
+
+def make_raw_row(i):
+    "The same row as kinterbasdb hands it to the type translators."
+    return (i, (u'name %d \xe9' % i).encode('utf-8'), i * 12345,
+        (2020, 1, 1 + i % 28, i % 24, i % 60, i % 60, 500000),
+        (2020, 1 + i % 12, 1 + i % 28), 'note %d' % i)
+
+def _sql(sql, num_params=0):
+    return sql % tuple('?' * num_params)
+
+def _compiled(queryset):
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    return _sql(sql, len(params))
+
+def get_recordings(rows):
+    "Result sets the fake driver replays for a BENCH_ROWS of ``rows`` rows."
+    columns = [(name, kind, scale) for name, (kind, scale) in zip(COLUMNS, COLUMN_TYPES)]
+    raw_rows = [make_raw_row(i) for i in range(1, rows + 1)]
+    recordings = [
+        fakedb.Recording(SELECT_ROWS, columns, raw_rows),
+        fakedb.Recording(_compiled(BenchRow.objects.all()), columns, raw_rows),
+        fakedb.Recording(_compiled(BenchRow.objects.filter(pk=1)), columns, raw_rows[:1]),
+        fakedb.Recording(_sql(INSERT_ROWS, len(COLUMNS)), param_types=COLUMN_TYPES),
+    ]
+
+    introspection = connection.introspection
+    name = ('RDB$NAME', 'TEXT', 0)
+    number = lambda label: (label, 'INTEGER', 0)
+    tables = [(TABLE.ljust(31),)] + [(('TABLE_%03d' % i).ljust(31),) for i in range(100)]
+    statements = fakedb.capture_statements(lambda cursor: (
+        introspection.get_table_list(cursor),
+        introspection.get_table_description(cursor, TABLE),
+        introspection.get_relations(cursor, TABLE),
+        introspection.get_indexes(cursor, TABLE)))
+    recordings.extend([
+        fakedb.Recording(statements[0], [name], tables),
+        fakedb.Recording(statements[1], [name, number('TYPE'), number('LENGTH'),
+            number('PRECISION'), number('SCALE'), number('NULL_FLAG')],
+            [('ID'.ljust(31), 8, 4, 0, 0, 1), ('NAME'.ljust(31), 37, 100, 0, 0, None),
+             ('AMOUNT'.ljust(31), 16, 8, 18, 4, None), ('CREATED'.ljust(31), 35, 8, 0, 0, None),
+             ('DAY'.ljust(31), 12, 4, 0, 0, None), ('NOTE'.ljust(31), 261, 8, 0, 0, None)]),
+        fakedb.Recording(statements[2], [number('POSITION'), number('OTHER_POSITION'), name], []),
+        fakedb.Recording(statements[3], [name, name], [('ID'.ljust(31), 'PRIMARY KEY')]),
+    ])
+    return recordings
+
+def create_table(rows):
+    "Creates and fills BENCH_ROWS, in embedded mode."
+    cursor = connection.cursor()
+    cursor.execute(CREATE_TABLE)
+    connection._commit()
+    cursor.executemany(INSERT_ROWS, [make_row(i) for i in range(1, rows + 1)])
+    connection._commit()
+
+def drop_table():
+    cursor = connection.cursor()
+    cursor.execute('DROP TABLE "%s"' % TABLE)
+    connection._commit()
+
+class Benchmark(object):
+    """
+    One measured operation. run() is timed; ``ops`` is the number of items
+    (rows, statements...) one run() handles, results are reported per item.
+    """
+    name = None
+    ops = 1
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+class ConvertQuery(Benchmark):
+    "FirebirdCursorWrapper.convert_query on a ten parameters statement."
+    name = 'convert_query'
+
+    def setup(self):
+        self.cursor = connection.cursor()
+        self.sql = 'SELECT * FROM T WHERE %s' % ' AND '.join(['C%d = %%s' % i for i in range(10)])
+
+    def run(self):
+        self.cursor.convert_query(self.sql, 10)
+
+class DecodeRows(Benchmark):
+    "Fetching every row of BENCH_ROWS, decoded by the TypeTranslator."
+    name = 'decode_rows'
+
+    def setup(self):
+        self.ops = self.rows
+        self.cursor = connection.cursor()
+
+    def run(self):
+        self.cursor.execute(SELECT_ROWS)
+        self.cursor.fetchall()
+
+class IterateRows(Benchmark):
+    "Iterating over a cursor on BENCH_ROWS, as RawQuery does."
+    name = 'iterate_rows'
+
+    def setup(self):
+        self.ops = self.rows
+        self.cursor = connection.cursor()
+
+    def run(self):
+        self.cursor.execute(SELECT_ROWS)
+        list(self.cursor)
+
+class OrmRows(Benchmark):
+    "Evaluating BenchRow.objects.all() into model instances."
+    name = 'orm_rows'
+
+    def setup(self):
+        self.ops = self.rows
+
+    def run(self):
+        list(BenchRow.objects.all())
+
+class StatementOverhead(Benchmark):
+    "A single row primary key lookup through the ORM."
+    name = 'statement_overhead'
+
+    def run(self):
+        list(BenchRow.objects.filter(pk=1))
+
+class CompilerLimits(Benchmark):
+    "SQLCompiler.as_sql for a sliced queryset, with the FIRST/SKIP rewriting."
+    name = 'compiler_limits'
+
+    def setup(self):
+        self.query = BenchRow.objects.all()[10:20].query
+
+    def run(self):
+        self.query.get_compiler(connection=connection).as_sql()
+
+class BulkInsert(Benchmark):
+    "FirebirdCursorWrapper.executemany of 1000 rows, rolled back afterwards."
+    name = 'bulk_insert'
+    ops = 1000
+
+    def setup(self):
+        self.cursor = connection.cursor()
+        self.params = [make_row(i) for i in range(self.rows + 1, self.rows + self.ops + 1)]
+
+    def run(self):
+        self.cursor.executemany(INSERT_ROWS, self.params)
+        connection._rollback()
+
+class Introspection(Benchmark):
+    "The table list plus the description, relations and indexes of a table."
+    name = 'introspection'
+    ops = 4
+
+    def setup(self):
+        self.cursor = connection.cursor()
+
+    def run(self):
+        introspection = connection.introspection
+        introspection.get_table_list(self.cursor)
+        introspection.get_table_description(self.cursor, TABLE)
+        introspection.get_relations(self.cursor, TABLE)
+        introspection.get_indexes(self.cursor, TABLE)
+
+BENCHMARKS = [ConvertQuery, DecodeRows, IterateRows, OrmRows, StatementOverhead, CompilerLimits,
+    BulkInsert, Introspection]
@@ -0,0 +1,239 @@
+"""
+Column oriented fetching for large numeric extracts.
+
+Fetching rows as tuples and rebuilding them into arrays boxes every value
+twice. fetch_columns() executes a statement with type translations keeping
+dates and decimals as plain numbers, reads it chunk by chunk with fetchmany and
+appends each column straight into a typed buffer:
+
+    from firebird.columnar import values_columns
+
+    ids, prices, days = values_columns(
+        Price.objects.values_list('id', 'price', 'day'))
+
+Columns come back in select order, as NumPy arrays when NumPy is installed and
+as array.array (or lists, for text and other values) otherwise:
+
+    INTEGER, BIGINT ...   int64
+    FLOAT, DOUBLE         float64
+    NUMERIC, DECIMAL      int64 scaled by 10 ** scale, or float64
+    DATE                  datetime64[D] (array.array: days since 1970-01-01)
+    TIMESTAMP             datetime64[us] (array.array: microseconds since 1970)
+
+The returned list also holds the ``names`` and ``scales`` of the columns, the
+scale being the number of decimal places of NUMERIC and DECIMAL columns and 0
+for the others:
+
+    columns = values_columns(Price.objects.values_list('id', 'price'))
+    ids, prices = columns
+    prices / 10.0 ** columns.scales[1]
+
+NULLs become NaN in float columns and NaT in date columns. An integer column
+that contains NULLs is promoted to float64. A value that doesn't fit the kind
+of its column raises a TypeError.
+"""
+import datetime
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from django.db import connections
+
+DEFAULT_CHUNK_SIZE = 10000
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_MICROSECONDS_PER_DAY = 86400 * 1000000
+# numpy stores NaT as the smallest int64
+NAT = -2 ** 63
+NAN = float('nan')
+
+if array('l').itemsize == 8:
+    INT64 = 'l'
+else:
+    # There is no 64 bits array typecode on this platform
+    INT64 = 'd'
+
+def date_conv_out(date_tuple):
+    if date_tuple is None:
+        return None
+    return datetime.date(*date_tuple).toordinal() - _EPOCH_ORDINAL
+
+def timestamp_conv_out(timestamp_tuple):
+    if timestamp_tuple is None:
+        return None
+    # kinterbasdb 3.2 and later pass the microseconds apart, earlier versions
+    # fractional seconds
+    if len(timestamp_tuple) == 7:
+        (year, month, day, hour, minute, second, microsecond) = timestamp_tuple
+        microseconds = second * 1000000 + microsecond
+    else:
+        (year, month, day, hour, minute, seconds) = timestamp_tuple
+        microseconds = int(round(seconds * 1000000))
+    days = datetime.date(year, month, day).toordinal() - _EPOCH_ORDINAL
+    return days * _MICROSECONDS_PER_DAY + (hour * 3600 + minute * 60) * 1000000 + microseconds
+
+def fixed_conv_out_scaled(fixed):
+    # The raw integer before the decimal point is applied
+    return fixed[0]
+
+def fixed_conv_out_float(fixed):
+    (value, scale) = fixed
+    if value is None:
+        return None
+    return float(value) / 10 ** -scale
+
+def get_type_translate_out(type_translator, decimals='int'):
+    """
+    Returns the out translations used for columnar fetching: the ones of
+    ``type_translator`` with dates and fixed point numbers kept as numbers.
+    """
+    if decimals not in ('int', 'float'):
+        raise ValueError("decimals must be 'int' or 'float', not %r" % (decimals,))
+    translate_out = dict(type_translator.type_translate_out)
+    translate_out['DATE'] = date_conv_out
+    translate_out['TIMESTAMP'] = timestamp_conv_out
+    if decimals == 'int':
+        translate_out['FIXED'] = fixed_conv_out_scaled
+    else:
+        translate_out['FIXED'] = fixed_conv_out_float
+    return translate_out
+
+def column_kind(description, decimals='int'):
+    "Maps a cursor.description entry to the kind of buffer used to store it."
+    type_code, scale = description[1], description[5]
+    if scale:
+        if decimals == 'int':
+            return 'int'
+        return 'float'
+    if type_code is datetime.datetime:
+        return 'timestamp'
+    if type_code is datetime.date:
+        return 'date'
+    if type_code in (int, long):
+        return 'int'
+    if type_code is float:
+        return 'float'
+    return 'object'
+
+# Types accepted in each kind of column, besides None
+_ACCEPTED_TYPES = {
+    'int': (int, long),
+    'float': (int, long, float),
+    'date': (int, long),
+    'timestamp': (int, long),
+}
+
+class Column(object):
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.checked = kind == 'object'
+        if kind in ('int', 'date', 'timestamp'):
+            self.data = array(INT64)
+        elif kind == 'float':
+            self.data = array('d')
+        else:
+            self.data = []
+
+    def check(self, values):
+        # All the values of a column come out of the same translator, checking
+        # the first one is enough. array.extend would truncate a Decimal.
+        for value in values:
+            if value is not None:
+                if not isinstance(value, _ACCEPTED_TYPES[self.kind]):
+                    raise TypeError('Column %s holds %r, which does not fit a %s column.' % (
+                        self.name, value, self.kind))
+                self.checked = True
+                return
+
+    def extend(self, values):
+        if not self.checked:
+            self.check(values)
+        size = len(self.data)
+        try:
+            self.data.extend(values)
+        except TypeError:
+            # Some value is NULL, array.extend may have appended part of the chunk
+            del self.data[size:]
+            self.extend_nullable(values)
+
+    def extend_nullable(self, values):
+        if self.kind == 'int':
+            self.kind = 'float'
+            self.data = array('d', self.data)
+        if self.kind == 'float':
+            null = NAN
+        else:
+            null = NAT
+        self.data.extend([value is None and null or value for value in values])
+
+    def to_numpy(self):
+        if self.kind == 'object':
+            data = numpy.empty(len(self.data), dtype=object)
+            data[:] = self.data
+            return data
+        if self.kind == 'float' or INT64 == 'd':
+            data = numpy.frombuffer(self.data, dtype=numpy.float64)
+            if self.kind != 'float':
+                data = data.astype(numpy.int64)
+        else:
+            data = numpy.frombuffer(self.data, dtype=numpy.int64)
+        if self.kind == 'date':
+            return data.view('datetime64[D]')
+        if self.kind == 'timestamp':
+            return data.view('datetime64[us]')
+        return data
+
+class Columns(list):
+    "The columns returned by fetch_columns(), with their names and scales."
+    def __init__(self, columns, names, scales):
+        list.__init__(self, columns)
+        self.names = names
+        self.scales = scales
+
+def fetch_columns(cursor, sql, params=(), chunk_size=DEFAULT_CHUNK_SIZE, decimals='int',
+        use_numpy=None):
+    """
+    Executes ``sql`` on ``cursor``, a FirebirdCursorWrapper, and returns its
+    result as a Columns list. The statement is executed here because the
+    columnar translations must be installed before it is prepared.
+
+    ``decimals`` is 'int' to keep NUMERIC/DECIMAL values as scaled integers or
+    'float' to convert them to float64. ``use_numpy`` defaults to True when
+    NumPy can be imported.
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ValueError('NumPy is not installed.')
+    cursor.set_type_trans_out(get_type_translate_out(cursor.type_translator, decimals))
+    try:
+        cursor.execute(sql, params)
+        description = cursor.description
+        columns = [Column(d[0], column_kind(d, decimals)) for d in description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+    finally:
+        cursor.set_type_trans_out(cursor.type_translator.type_translate_out)
+    names = [d[0].strip() for d in description]
+    # Firebird reports the scale as a negative exponent
+    scales = [abs(d[5] or 0) for d in description]
+    if use_numpy:
+        return Columns([column.to_numpy() for column in columns], names, scales)
+    return Columns([column.data for column in columns], names, scales)
+
+def values_columns(queryset, chunk_size=DEFAULT_CHUNK_SIZE, decimals='int', use_numpy=None):
+    """
+    Runs a values_list() queryset and returns its result as columns, see
+    fetch_columns().
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    return fetch_columns(connection.cursor(), sql, params, chunk_size, decimals, use_numpy)
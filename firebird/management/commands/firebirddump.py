@@ -0,0 +1,98 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from firebird.management import dumpfile
+
+class Command(BaseCommand):
+    help = 'Dumps the rows of the given tables (all of them by default) for firebirdload.'
+    args = '[table ...]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a specific database to dump. '
+                'Defaults to the "default" database.'),
+        make_option('--format', action='store', dest='format', default='binary',
+            type='choice', choices=dumpfile.FORMATS,
+            help='Dump format, "binary" (default) or "csv".'),
+        make_option('--output', action='store', dest='output', default='-',
+            help='File to write (a directory for csv). Defaults to stdout.'),
+        make_option('--batch-size', action='store', dest='batch_size', default=10000,
+            type='int', help='Rows fetched from the server per round trip.'),
+    )
+
+    def handle(self, *tables, **options):
+        using = options.get('database', DEFAULT_DB_ALIAS)
+        format = options.get('format', 'binary')
+        output = options.get('output', '-')
+        batch_size = options.get('batch_size', 10000)
+        verbosity = int(options.get('verbosity', 1))
+        if format == 'csv' and output == '-':
+            raise CommandError('The csv format needs an --output directory.')
+
+        connection = connections[using]
+        cursor = connection.cursor()
+        all_tables = connection.introspection.get_table_list(cursor)
+        if tables:
+            tables = [table.upper() for table in tables]
+            unknown = [table for table in tables if table not in all_tables]
+            if unknown:
+                raise CommandError('Unknown table(s): %s' % ', '.join(unknown))
+        else:
+            tables = all_tables
+        tables = self.sort_tables(connection, cursor, tables)
+
+        # Everything is read in the same snapshot transaction, so the dump is
+        # consistent even while the database is in use.
+        writer = dumpfile.get_writer(format, output, tables)
+        try:
+            for table in tables:
+                columns = self.get_columns(connection, cursor, table)
+                cursor.execute('SELECT %s FROM "%s"' % (
+                    ', '.join(['"%s"' % column for column in columns]), table))
+                writer.start_table(table, columns)
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    writer.write_rows(rows)
+                    count += len(rows)
+                writer.end_table()
+                if verbosity >= 2:
+                    sys.stderr.write('Dumped %d rows from %s\n' % (count, table))
+        finally:
+            writer.close()
+        connection.close()
+
+    def get_columns(self, connection, cursor, table):
+        "The columns of the table that hold data, COMPUTED BY ones can't be loaded."
+        introspection = connection.introspection
+        computed = introspection.get_computed_columns(cursor, table)
+        return [row[0] for row in introspection.get_table_description(cursor, table)
+            if row[0] not in computed]
+
+    def sort_tables(self, connection, cursor, tables):
+        """
+        Orders tables so that referenced tables come first, an order they can
+        be loaded in with their foreign keys in place. Tables in a reference
+        cycle keep their order: firebirdload drops the foreign keys of the
+        loaded tables meanwhile and doesn't depend on it.
+        """
+        dependencies = {}
+        for table in tables:
+            relations = connection.introspection.get_relations(cursor, table)
+            dependencies[table] = set([other for (index, other) in relations.values()
+                if other != table and other in tables])
+        ordered = []
+        while dependencies:
+            ready = [table for table in tables
+                if table in dependencies and not (dependencies[table] - set(ordered))]
+            if not ready:
+                ready = [table for table in tables if table in dependencies][:1]
+            for table in ready:
+                ordered.append(table)
+                del dependencies[table]
+        return ordered
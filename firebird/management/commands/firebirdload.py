@@ -0,0 +1,191 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from firebird.backend.base import Database
+from firebird.management import dumpfile
+
+class Command(BaseCommand):
+    help = 'Loads a dump written by firebirddump.'
+    args = 'path'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a specific database to load '
+                'into. Defaults to the "default" database.'),
+        make_option('--format', action='store', dest='format', default='binary',
+            type='choice', choices=dumpfile.FORMATS,
+            help='Dump format, "binary" (default) or "csv".'),
+        make_option('--batch-size', action='store', dest='batch_size', default=1000,
+            type='int', help='Rows sent to the server per executemany call.'),
+        make_option('--commit-every', action='store', dest='commit_every', default=50000,
+            type='int', help='Rows inserted between commits.'),
+        make_option('--truncate', action='store_true', dest='truncate', default=False,
+            help='Delete the existing rows of every loaded table first.'),
+    )
+
+    def handle(self, path=None, **options):
+        if path is None:
+            raise CommandError('Enter the path of the dump to load.')
+        using = options.get('database', DEFAULT_DB_ALIAS)
+        format = options.get('format', 'binary')
+        self.batch_size = options.get('batch_size', 1000)
+        self.commit_every = options.get('commit_every', 50000)
+        self.truncate = options.get('truncate', False)
+        self.verbosity = int(options.get('verbosity', 1))
+        self.using = using
+        self.connection = connections[using]
+
+        reader = dumpfile.get_reader(format, path, self.batch_size)
+        transaction.commit_unless_managed(using=using)
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+        try:
+            # Rows are inserted in dump order, which can't satisfy the
+            # foreign keys of self-referencing tables or reference cycles.
+            foreign_keys = self.drop_foreign_keys(reader.tables)
+            try:
+                if self.truncate:
+                    self.truncate_tables(reader.tables)
+                for table, columns, batches in reader:
+                    self.load_table(table, columns, batches, format == 'csv')
+            finally:
+                transaction.rollback(using=using)
+                failed = self.add_foreign_keys(foreign_keys)
+        finally:
+            reader.close()
+            transaction.rollback(using=using)
+            transaction.leave_transaction_management(using=using)
+        self.connection.close()
+        if failed:
+            raise CommandError('The loaded rows break some foreign keys. Fix them '
+                'and create the keys again with:\n%s' % ';\n'.join(failed))
+
+    def drop_foreign_keys(self, tables):
+        """
+        Drops the foreign keys of ``tables`` and returns them as (table,
+        foreign key) pairs for add_foreign_keys().
+        """
+        cursor = self.connection.cursor()
+        foreign_keys = []
+        for table in tables:
+            for foreign_key in self.connection.introspection.get_foreign_keys(cursor, table):
+                foreign_keys.append((table, foreign_key))
+        self.execute_ddl(cursor, ['ALTER TABLE "%s" DROP CONSTRAINT "%s"' % (table, foreign_key[0])
+            for table, foreign_key in foreign_keys])
+        return foreign_keys
+
+    def add_foreign_keys(self, foreign_keys):
+        """
+        Creates the dropped foreign keys again and returns the statements of
+        the ones the loaded rows don't satisfy.
+        """
+        cursor = self.connection.cursor()
+        failed = []
+        for table, foreign_key in foreign_keys:
+            sql = self.foreign_key_sql(table, foreign_key)
+            try:
+                self.execute_ddl(cursor, [sql])
+            except Database.Error, e:
+                transaction.rollback(using=self.using)
+                sys.stderr.write('Could not create foreign key %s of %s: %s\n' % (
+                    foreign_key[0], table, e))
+                failed.append(sql)
+        return failed
+
+    def foreign_key_sql(self, table, foreign_key):
+        name, columns, other_table, other_columns, update_rule, delete_rule = foreign_key
+        sql = 'ALTER TABLE "%s" ADD CONSTRAINT "%s" FOREIGN KEY (%s) REFERENCES "%s" (%s)' % (
+            table, name, ', '.join(['"%s"' % column for column in columns]), other_table,
+            ', '.join(['"%s"' % column for column in other_columns]))
+        if update_rule:
+            sql += ' ON UPDATE %s' % update_rule
+        if delete_rule:
+            sql += ' ON DELETE %s' % delete_rule
+        return sql
+
+    def truncate_tables(self, tables):
+        "Deletes the rows of ``tables``, once their foreign keys are dropped."
+        cursor = self.connection.cursor()
+        for table in tables:
+            cursor.execute('DELETE FROM "%s"' % table)
+        transaction.commit(using=self.using)
+
+    def execute_ddl(self, cursor, statements):
+        for sql in statements:
+            cursor.execute(sql)
+        transaction.commit(using=self.using)
+
+    def load_table(self, table, columns, batches, parse):
+        cursor = self.connection.cursor()
+        introspection = self.connection.introspection
+        triggers = introspection.get_triggers(cursor, table)
+        indexes = introspection.get_plain_indexes(cursor, table)
+        # Older dumps hold the values of COMPUTED BY columns, which can't be
+        # inserted
+        computed = introspection.get_computed_columns(cursor, table)
+        stored = [i for i, column in enumerate(columns) if column not in computed]
+        if len(stored) == len(columns):
+            stored = None
+        else:
+            columns = [columns[i] for i in stored]
+        parsers = None
+        if parse:
+            parsers = self.get_parsers(cursor, table, columns)
+
+        # The _TR autoinc triggers are disabled like the others, the dump
+        # carries the primary keys and the generator is moved past them later.
+        self.execute_ddl(cursor,
+            ['ALTER TRIGGER "%s" INACTIVE' % name for name in triggers] +
+            ['ALTER INDEX "%s" INACTIVE' % name for name in indexes])
+        try:
+            sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (table,
+                ', '.join(['"%s"' % column for column in columns]),
+                ', '.join(['%s'] * len(columns)))
+            count = uncommitted = 0
+            for rows in batches:
+                if stored is not None:
+                    rows = [[row[i] for i in stored] for row in rows]
+                if parsers:
+                    rows = dumpfile.parse_rows(rows, parsers)
+                for start in range(0, len(rows), self.batch_size):
+                    chunk = rows[start:start + self.batch_size]
+                    cursor.executemany(sql, chunk)
+                    count += len(chunk)
+                    uncommitted += len(chunk)
+                    if uncommitted >= self.commit_every:
+                        transaction.commit(using=self.using)
+                        uncommitted = 0
+            transaction.commit(using=self.using)
+        finally:
+            transaction.rollback(using=self.using)
+            # Reactivating an index rebuilds it
+            self.execute_ddl(cursor,
+                ['ALTER INDEX "%s" ACTIVE' % name for name in indexes] +
+                ['ALTER TRIGGER "%s" ACTIVE' % name for name in triggers])
+        self.reset_generator(cursor, table)
+        if self.verbosity >= 1:
+            sys.stdout.write('Loaded %d rows into %s\n' % (count, table))
+
+    def get_parsers(self, cursor, table, columns):
+        introspection = self.connection.introspection
+        field_types = {}
+        for row in introspection.get_table_description(cursor, table):
+            field_types[row[0]] = introspection.data_types_reverse.get(row[1])
+        return [dumpfile.CSV_PARSERS.get(field_types.get(column)) for column in columns]
+
+    def reset_generator(self, cursor, table):
+        "Moves the autoinc generator of the table past the loaded primary keys."
+        gn_name = self.connection.ops.get_generator_name(table)
+        cursor.execute("select 1 from rdb$generators where rdb$generator_name = '%s'" % gn_name)
+        if cursor.fetchone() is None:
+            return
+        pk_columns = [name for name, info in
+            self.connection.introspection.get_indexes(cursor, table).items() if info['primary_key']]
+        if len(pk_columns) != 1:
+            return
+        cursor.execute('SELECT MAX("%s") FROM "%s"' % (pk_columns[0], table))
+        value = cursor.fetchone()[0] or 0
+        self.execute_ddl(cursor, ['SET GENERATOR "%s" TO %d' % (gn_name, value)])
@@ -1,4 +1,5 @@
 import sys
+import time
 
 from django.core.management.base import LabelCommand, CommandError
 from django.core.mail import mail_admins
@@ -6,6 +7,7 @@ from django.conf import settings
 from django.utils.importlib import import_module
 from django.db import connections
 
+from firebird.backend import metrics
 from firebird.backend.base import Database
 
 class Command(LabelCommand):
@@ -29,10 +31,14 @@ class Command(LabelCommand):
                 post_events = conduit.wait()
                 for event, posted in post_events.items():
                     if posted:
+                        metrics.events_received.inc((label, event), posted)
+                        start = time.time()
                         processors[event](connection, post_events)
+                        metrics.event_dispatch_seconds.observe((label, event), time.time() - start)
             except Exception, e:
                 import traceback
 
+                metrics.event_errors.inc((label,))
                 connection.rollback()
                 for conn in connections.all():
                     conn.close()
@@ -62,7 +68,9 @@ class Command(LabelCommand):
             params['user'] = settings_dict['USER']
         if settings_dict['PASSWORD']:
             params['password'] = settings_dict['PASSWORD']
+        start = time.time()
         connection = Database.connect(**params)
+        metrics.connect_seconds.observe((alias,), time.time() - start)
 
         # Read only transaction
         connection.default_tpb = (
@@ -0,0 +1,288 @@
+"""
+Files written by the firebirddump command and read by firebirdload.
+
+binary: a single file starting with MAGIC and holding a stream of
+        records: ('tables', [name, ...]) listing the tables in load order,
+        then for every table a ('table', name, columns) header followed by
+        ('rows', [row, ...]) batches, and a final ('end',). Each record is
+        marshalled and preceded by its length; decimals, dates, times and
+        timestamps, which marshal doesn't know, are written as (type,
+        value) tuples. Unlike pickle, reading a file never runs code from
+        it. The file is gzipped when its name ends with ".gz"; "-" is
+        stdin/stdout.
+csv:    a directory with one NAME.csv file per table, the first line holding
+        the column names, plus a TABLES file listing the tables in load
+        order. Values are UTF-8 and NULL is written as \N; a text starting
+        with a backslash gets one more in front of it.
+
+Readers list the tables of a dump in their ``tables`` attribute before any of
+them is read.
+"""
+import csv
+import datetime
+import gzip
+import marshal
+import os
+import struct
+import sys
+from decimal import Decimal
+
+FORMATS = ('binary', 'csv')
+MAGIC = 'FIREBIRDDUMP 1\n'
+NULL = '\\N'
+TABLES_FILE = 'TABLES'
+
+def _open(path, mode):
+    if path == '-':
+        if 'r' in mode:
+            return sys.stdin
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+_LENGTH = struct.Struct('>I')
+
+def _pack(value):
+    # Row values are never tuples, so a tuple is always a tagged value
+    if isinstance(value, Decimal):
+        return ('decimal', str(value))
+    if isinstance(value, datetime.datetime):
+        return ('datetime', (value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond))
+    if isinstance(value, datetime.date):
+        return ('date', (value.year, value.month, value.day))
+    if isinstance(value, datetime.time):
+        return ('time', (value.hour, value.minute, value.second, value.microsecond))
+    return value
+
+_UNPACKERS = {
+    'decimal': Decimal,
+    'datetime': lambda value: datetime.datetime(*value),
+    'date': lambda value: datetime.date(*value),
+    'time': lambda value: datetime.time(*value),
+}
+
+def _unpack(value):
+    if type(value) is not tuple:
+        return value
+    try:
+        return _UNPACKERS[value[0]](value[1])
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise ValueError('Corrupted dump file, invalid value %r.' % (value,))
+
+class BinaryWriter(object):
+    def __init__(self, path, tables):
+        self.stream = _open(path, 'wb')
+        self.stream.write(MAGIC)
+        self._write(('tables', list(tables)))
+
+    def _write(self, record):
+        data = marshal.dumps(record)
+        self.stream.write(_LENGTH.pack(len(data)))
+        self.stream.write(data)
+
+    def start_table(self, table, columns):
+        self._write(('table', table, list(columns)))
+
+    def write_rows(self, rows):
+        self._write(('rows', [[_pack(value) for value in row] for row in rows]))
+
+    def end_table(self):
+        pass
+
+    def close(self):
+        self._write(('end',))
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+class BinaryReader(object):
+    def __init__(self, path):
+        self.stream = _open(path, 'rb')
+        if self.stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a binary dump file.' % path)
+        self._record = None
+        record = self._read()
+        if record[0] != 'tables':
+            raise ValueError('Corrupted dump file, it does not start with the table list.')
+        self.tables = record[1]
+
+    def _read(self):
+        header = self.stream.read(_LENGTH.size)
+        if len(header) != _LENGTH.size:
+            raise ValueError('Truncated dump file.')
+        (length,) = _LENGTH.unpack(header)
+        data = self.stream.read(length)
+        if len(data) != length:
+            raise ValueError('Truncated dump file.')
+        try:
+            record = marshal.loads(data)
+        except (EOFError, TypeError, ValueError):
+            record = None
+        if type(record) is not tuple or not record:
+            raise ValueError('Corrupted dump file, invalid record.')
+        return record
+
+    def _next(self):
+        if self._record is not None:
+            record, self._record = self._record, None
+            return record
+        return self._read()
+
+    def _batches(self):
+        while True:
+            record = self._next()
+            if record[0] != 'rows':
+                self._record = record
+                return
+            yield [[_unpack(value) for value in row] for row in record[1]]
+
+    def __iter__(self):
+        """
+        Yields (table, columns, batches) for each table, batches being an
+        iterator over lists of rows that must be consumed before the next
+        table is read.
+        """
+        while True:
+            record = self._next()
+            if record[0] == 'end':
+                break
+            if record[0] != 'table':
+                raise ValueError('Corrupted dump file, unexpected %r record.' % (record[0],))
+            table, columns = record[1], record[2]
+            batches = self._batches()
+            yield table, columns, batches
+            # Skip what the caller did not read
+            for batch in batches:
+                pass
+
+    def close(self):
+        if self.stream is not sys.stdin:
+            self.stream.close()
+
+def _encode(value):
+    if value is None:
+        return NULL
+    if isinstance(value, basestring):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if value.startswith('\\'):
+            # Keeps a text like \N apart from NULL
+            value = '\\' + value
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _decode(value):
+    if value == NULL:
+        return None
+    if value.startswith('\\'):
+        value = value[1:]
+    return value.decode('utf-8')
+
+class CsvWriter(object):
+    def __init__(self, path, tables):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.tables = list(tables)
+        self.stream = None
+
+    def start_table(self, table, columns):
+        self.stream = open(os.path.join(self.path, '%s.csv' % table), 'wb')
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows([[_encode(value) for value in row] for row in rows])
+
+    def end_table(self):
+        self.stream.close()
+        self.stream = None
+
+    def close(self):
+        index = open(os.path.join(self.path, TABLES_FILE), 'w')
+        try:
+            index.write('\n'.join(self.tables) + '\n')
+        finally:
+            index.close()
+
+class CsvReader(object):
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        index = open(os.path.join(self.path, TABLES_FILE))
+        try:
+            self.tables = [line.strip() for line in index if line.strip()]
+        finally:
+            index.close()
+
+    def _batches(self, reader):
+        batch = []
+        for row in reader:
+            batch.append([_decode(value) for value in row])
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def __iter__(self):
+        for table in self.tables:
+            stream = open(os.path.join(self.path, '%s.csv' % table), 'rb')
+            try:
+                reader = csv.reader(stream)
+                columns = reader.next()
+                yield table, columns, self._batches(reader)
+            finally:
+                stream.close()
+
+    def close(self):
+        pass
+
+def get_writer(format, path, tables):
+    if format == 'csv':
+        return CsvWriter(path, tables)
+    return BinaryWriter(path, tables)
+
+def get_reader(format, path, batch_size):
+    if format == 'csv':
+        return CsvReader(path, batch_size)
+    return BinaryReader(path)
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+def _parse_datetime(value):
+    if '.' in value:
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+def _parse_time(value):
+    if '.' in value:
+        return datetime.datetime.strptime(value, '%H:%M:%S.%f').time()
+    return datetime.datetime.strptime(value, '%H:%M:%S').time()
+
+# CSV values are text, these turn them back into what kinterbasdb expects for
+# the Django field types reported by DatabaseIntrospection.data_types_reverse
+CSV_PARSERS = {
+    'SmallIntegerField': int,
+    'IntegerField': int,
+    'FloatField': float,
+    'DecimalField': Decimal,
+    'DateField': _parse_date,
+    'DateTimeField': _parse_datetime,
+    'TimeField': _parse_time,
+}
+
+def parse_rows(rows, parsers):
+    "Applies ``parsers``, one callable or None per column, to CSV ``rows``."
+    columns = [(i, parser) for i, parser in enumerate(parsers) if parser is not None]
+    for row in rows:
+        for i, parser in columns:
+            if row[i] is not None:
+                row[i] = parser(row[i])
+    return rows
@@ -0,0 +1,285 @@
+"""
+Evaluates independent read-only querysets at the same time.
+
+Each Django alias has a single connection per thread, so querysets evaluated
+one after another cost the sum of their latencies. evaluate() hands every
+queryset to a worker thread that borrows an extra read-only, read committed
+attachment from a small per alias pool, so the whole batch costs about as much
+as its slowest query:
+
+    from firebird.parallel import evaluate
+
+    users, orders = evaluate([
+        User.objects.filter(is_active=True),
+        Order.objects.order_by('-created')[:10],
+    ], timeout=5)
+    if users.ok:
+        ...
+
+The pool size is read from the PARALLEL_CONNECTIONS key of the alias in
+settings.DATABASES (4 by default).
+"""
+import sys
+import threading
+import time
+import Queue
+
+from django.db import connections
+
+from firebird.backend import metrics
+from firebird.backend.base import Database, DatabaseError, parse_error
+
+DEFAULT_POOL_SIZE = 4
+
+# Firebird error numbers after which an attachment can't be used any more:
+# network errors, connection shutdown and unavailable database.
+CONNECTION_ERRORS = (-902, -904)
+
+# Every query runs in its own read only, read committed transaction
+READ_ONLY_TPB = (
+    Database.isc_tpb_read + \
+    Database.isc_tpb_read_committed + \
+    Database.isc_tpb_rec_version)
+
+class QueryTimeout(DatabaseError):
+    pass
+
+class QueryResult(object):
+    """
+    The outcome of one queryset passed to evaluate(). Either ``value`` holds
+    the evaluated rows or ``error`` holds the exception that was raised.
+    """
+    def __init__(self, queryset, value=None, exc_info=None, elapsed=None):
+        self.queryset = queryset
+        self.value = value
+        self.exc_info = exc_info
+        self.elapsed = elapsed
+
+    def _get_error(self):
+        if self.exc_info is not None:
+            return self.exc_info[1]
+    error = property(_get_error)
+
+    def _get_ok(self):
+        return self.exc_info is None
+    ok = property(_get_ok)
+
+    def _get_timed_out(self):
+        return isinstance(self.error, QueryTimeout)
+    timed_out = property(_get_timed_out)
+
+    def get(self):
+        "Returns the evaluated rows, re-raising the query error if there was one."
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+class ConnectionPool(object):
+    """
+    A bounded set of read-only attachments to the database of one alias.
+    Attachments are opened on demand and kept for later calls.
+    """
+    def __init__(self, alias, size):
+        self.alias = alias
+        self.size = size
+        self._idle = []
+        self._opened = 0
+        self._lock = threading.Condition()
+
+    def acquire(self, deadline=None):
+        self._lock.acquire()
+        try:
+            while not self._idle and self._opened >= self.size:
+                if deadline is None:
+                    self._lock.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise QueryTimeout('No free connection for "%s" before the deadline.' % self.alias)
+                    self._lock.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        finally:
+            self._lock.release()
+        try:
+            return self.connect()
+        except:
+            self.discard(None)
+            raise
+
+    def connect(self):
+        wrapper = connections[self.alias]
+        start = time.time()
+        connection = Database.connect(**wrapper._get_connection_params())
+        metrics.connect_seconds.observe((self.alias,), time.time() - start)
+        connection.default_tpb = READ_ONLY_TPB
+        return connection
+
+    def release(self, connection):
+        self._lock.acquire()
+        try:
+            self._idle.append(connection)
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def discard(self, connection):
+        "Forgets a broken attachment, making room for a new one."
+        if connection is not None:
+            try:
+                connection.close()
+            except Database.Error:
+                pass
+        self._lock.acquire()
+        try:
+            self._opened -= 1
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        finally:
+            self._lock.release()
+        for connection in idle:
+            try:
+                connection.close()
+            except Database.Error:
+                pass
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(alias):
+    _pools_lock.acquire()
+    try:
+        if alias not in _pools:
+            size = connections[alias].settings_dict.get('PARALLEL_CONNECTIONS', DEFAULT_POOL_SIZE)
+            _pools[alias] = ConnectionPool(alias, size)
+        return _pools[alias]
+    finally:
+        _pools_lock.release()
+
+def close_pools():
+    "Closes the idle attachments of every pool."
+    _pools_lock.acquire()
+    try:
+        pools = _pools.values()
+    finally:
+        _pools_lock.release()
+    for pool in pools:
+        pool.close()
+
+def _evaluate_one(queryset, connection):
+    # DatabaseWrapper is thread local, so plugging the borrowed attachment in
+    # here only affects the current worker thread.
+    wrapper = connections[queryset.db]
+    wrapper.connection = connection
+    wrapper._type_translator.set_charset(connection.charset)
+    try:
+        try:
+            rows = list(queryset.all())
+        except:
+            connection.rollback()
+            raise
+        connection.commit()
+        return rows
+    finally:
+        wrapper.connection = None
+
+def is_connection_error(e):
+    "Tells whether ``e`` left the attachment it was raised on unusable."
+    if isinstance(e, Database.InterfaceError):
+        return True
+    if isinstance(e, Database.OperationalError):
+        return parse_error(e)[0] in CONNECTION_ERRORS
+    return False
+
+def _worker(tasks, results, deadline, cancelled):
+    while not cancelled.isSet():
+        try:
+            index, queryset = tasks.get_nowait()
+        except Queue.Empty:
+            return
+        start = time.time()
+        pool = get_pool(queryset.db)
+        try:
+            connection = pool.acquire(deadline)
+        except Exception:
+            results.put((index, QueryResult(queryset, exc_info=sys.exc_info())))
+            continue
+        try:
+            value = _evaluate_one(queryset, connection)
+        except Exception, e:
+            # Conflicts and SQL errors leave the attachment in a usable state
+            if is_connection_error(e):
+                pool.discard(connection)
+            else:
+                pool.release(connection)
+            result = QueryResult(queryset, exc_info=sys.exc_info(), elapsed=time.time() - start)
+        else:
+            pool.release(connection)
+            result = QueryResult(queryset, value=value, elapsed=time.time() - start)
+        results.put((index, result))
+
+def evaluate(querysets, timeout=None):
+    """
+    Evaluates ``querysets`` concurrently and returns a list of QueryResult in
+    the same order. Only use it for read-only querysets: they run on separate
+    attachments and never see uncommitted changes of the calling thread.
+
+    ``timeout`` bounds the whole call in seconds. Queries not finished by then
+    are reported as QueryTimeout; the ones still running complete in the
+    background and hand their attachment back to the pool.
+    """
+    querysets = list(querysets)
+    if not querysets:
+        return []
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    tasks = Queue.Queue()
+    for index, queryset in enumerate(querysets):
+        tasks.put((index, queryset))
+    results = Queue.Queue()
+    cancelled = threading.Event()
+
+    workers = 0
+    for alias in set([qs.db for qs in querysets]):
+        workers += get_pool(alias).size
+    for i in range(min(workers, len(querysets))):
+        thread = threading.Thread(target=_worker, args=(tasks, results, deadline, cancelled))
+        thread.setDaemon(True)
+        thread.start()
+
+    output = [None] * len(querysets)
+    pending = len(querysets)
+    try:
+        while pending:
+            if deadline is None:
+                index, result = results.get()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    index, result = results.get(True, remaining)
+                except Queue.Empty:
+                    break
+            output[index] = result
+            pending -= 1
+    finally:
+        cancelled.set()
+
+    for index, result in enumerate(output):
+        if result is None:
+            try:
+                raise QueryTimeout('Query did not finish within %s seconds.' % timeout)
+            except QueryTimeout:
+                output[index] = QueryResult(querysets[index], exc_info=sys.exc_info())
+    return output
@@ -0,0 +1,234 @@
+"""
+Query plan assertions for tests.
+
+capture_plans() records the PLAN Firebird picks for every statement executed
+through FirebirdCursorWrapper inside a with block:
+
+    from firebird.plans import capture_plans
+
+    with capture_plans() as plans:
+        list(Order.objects.filter(customer=customer))
+    plans.assert_index_used(Order)
+    plans.assert_no_natural_scan('CUSTOMER')
+    plans.assert_matches_baseline('plans.json', 'orders_by_customer')
+
+The baseline file is (re)written when the name is missing from it or when the
+FIREBIRD_UPDATE_PLANS environment variable is set; otherwise the plans are
+compared with it and a difference fails the test with a diff.
+"""
+import difflib
+import os
+import re
+import thread
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from firebird.backend.base import Database, FirebirdCursorWrapper
+
+UPDATE_ENVIRON = 'FIREBIRD_UPDATE_PLANS'
+
+# A table (or alias) access in a plan: "T NATURAL", "T INDEX (I1, I2)" or
+# "T ORDER I1" optionally followed by "INDEX (I2)".
+_ACCESS_RE = re.compile(r'([^\s(),]+)\s+(?:(NATURAL)|INDEX\s*\(([^)]*)\)|'
+    r'ORDER\s+([^\s(),]+)(?:\s+INDEX\s*\(([^)]*)\))?)', re.IGNORECASE)
+
+class Access(object):
+    "How one table is read by a plan."
+    def __init__(self, table, method, indexes=()):
+        self.table = table
+        self.method = method
+        self.indexes = list(indexes)
+
+    def __eq__(self, other):
+        return (self.table, self.method, self.indexes) == (other.table, other.method, other.indexes)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<Access %s %s %s>' % (self.table, self.method, ', '.join(self.indexes))
+
+def _split_indexes(text):
+    if not text:
+        return []
+    return [name.strip().strip('"') for name in text.split(',') if name.strip()]
+
+def parse_plan(plan):
+    "Returns the list of Access of a PLAN string, in plan order."
+    accesses = []
+    for match in _ACCESS_RE.finditer(plan or ''):
+        table, natural, indexes, order, order_indexes = match.groups()
+        table = table.strip('"').upper()
+        if natural:
+            accesses.append(Access(table, 'NATURAL'))
+        elif order:
+            accesses.append(Access(table, 'ORDER', [order.strip('"')] + _split_indexes(order_indexes)))
+        else:
+            accesses.append(Access(table, 'INDEX', _split_indexes(indexes)))
+    return accesses
+
+def _table_name(table):
+    "Accepts a table name or a model class."
+    if hasattr(table, '_meta'):
+        table = table._meta.db_table
+    return table.strip('"').upper()
+
+class CapturedStatement(object):
+    def __init__(self, sql, plan):
+        self.sql = sql
+        self.plan = plan
+        self.accesses = parse_plan(plan)
+
+    def __repr__(self):
+        return '%s\n  %s' % (self.sql, self.plan)
+
+def _diff_lines(statements):
+    lines = []
+    for sql, plan in statements:
+        lines.append(sql)
+        lines.extend(['    ' + line for line in plan.splitlines()])
+    return lines
+
+class PlanCapture(object):
+    """
+    Context manager recording the plans of the statements executed while it
+    is active. Only the statements of the entering thread are recorded unless
+    ``all_threads`` is True.
+    """
+    def __init__(self, all_threads=False):
+        self.all_threads = all_threads
+        self.statements = []
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = thread.get_ident()
+        FirebirdCursorWrapper.statement_observers.append(self.observe)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        FirebirdCursorWrapper.statement_observers.remove(self.observe)
+        return False
+
+    def observe(self, cursor, query):
+        if not self.all_threads and thread.get_ident() != self._thread:
+            return
+        self.statements.append(CapturedStatement(query, self.get_plan(cursor, query)))
+
+    def get_plan(self, cursor, query):
+        # Prepare on a separate cursor, not to disturb the pending result set
+        plan_cursor = cursor.cursor.connection.cursor()
+        try:
+            try:
+                return (plan_cursor.prep(query).plan or '').strip()
+            except Database.Error:
+                # The statement itself succeeded, DDL for instance may not be
+                # prepared a second time. Its plan is left empty.
+                return ''
+        finally:
+            plan_cursor.close()
+
+    def accesses(self, table=None):
+        "Every recorded Access, optionally only those of ``table``."
+        accesses = []
+        for statement in self.statements:
+            accesses.extend(statement.accesses)
+        if table is not None:
+            name = _table_name(table)
+            accesses = [access for access in accesses if access.table == name]
+        return accesses
+
+    def _statements_reading(self, name, method):
+        return [statement for statement in self.statements
+            if [access for access in statement.accesses
+                if access.table == name and access.method == method]]
+
+    def assert_index_used(self, *tables):
+        "Fails unless every access to each of ``tables`` goes through an index."
+        for table in tables:
+            name = _table_name(table)
+            if not self.accesses(name):
+                raise AssertionError('No captured statement reads %s.' % name)
+            natural = self._statements_reading(name, 'NATURAL')
+            if natural:
+                raise AssertionError('%s is not read by index in:\n%s' % (name,
+                    '\n'.join([repr(statement) for statement in natural])))
+
+    def assert_no_natural_scan(self, *tables):
+        "Fails if any of ``tables``, or any table when none is given, is scanned."
+        if tables:
+            names = [_table_name(table) for table in tables]
+        else:
+            names = list(set([access.table for access in self.accesses()]))
+        failures = []
+        for name in names:
+            for statement in self._statements_reading(name, 'NATURAL'):
+                failures.append('%s: %r' % (name, statement))
+        if failures:
+            raise AssertionError('NATURAL scans:\n%s' % '\n'.join(failures))
+
+    def as_baseline(self):
+        return [[statement.sql, statement.plan] for statement in self.statements]
+
+    def assert_matches_baseline(self, path, name, update=None):
+        """
+        Compares the captured plans with the ones saved as ``name`` in the JSON
+        file at ``path``, saving them instead if they are not there yet or if
+        ``update`` (by default the FIREBIRD_UPDATE_PLANS environment variable)
+        is true.
+        """
+        if update is None:
+            update = bool(os.environ.get(UPDATE_ENVIRON))
+        baselines = {}
+        if os.path.exists(path):
+            stream = open(path)
+            try:
+                baselines = json.load(stream)
+            finally:
+                stream.close()
+        current = self.as_baseline()
+        if update or name not in baselines:
+            baselines[name] = current
+            stream = open(path, 'w')
+            try:
+                json.dump(baselines, stream, indent=2, sort_keys=True)
+            finally:
+                stream.close()
+            return
+        expected = baselines[name]
+        if [plan for sql, plan in expected] == [plan for sql, plan in current]:
+            return
+        diff = difflib.unified_diff(_diff_lines(expected), _diff_lines(current),
+            '%s (baseline)' % name, '%s (current)' % name, lineterm='')
+        raise AssertionError('Query plans changed, set %s=1 to accept them:\n%s' % (
+            UPDATE_ENVIRON, '\n'.join(diff)))
+
+def capture_plans(all_threads=False):
+    return PlanCapture(all_threads)
+
+class PlanAssertionsMixin(object):
+    """
+    TestCase mixin running a callable under capture_plans(), in the style of
+    assertNumQueries.
+    """
+    def assertIndexUsed(self, tables, func, *args, **kwargs):
+        plans = capture_plans()
+        plans.__enter__()
+        try:
+            func(*args, **kwargs)
+        finally:
+            plans.__exit__(None, None, None)
+        plans.assert_index_used(*tables)
+        return plans
+
+    def assertNoNaturalScan(self, tables, func, *args, **kwargs):
+        plans = capture_plans()
+        plans.__enter__()
+        try:
+            func(*args, **kwargs)
+        finally:
+            plans.__exit__(None, None, None)
+        plans.assert_no_natural_scan(*tables)
+        return plans
@@ -0,0 +1,153 @@
+"""
+Retries of statement blocks failing on lock conflicts, deadlocks and update
+conflicts.
+
+Under concurrent updates Firebird rejects the statement that loses the race
+with a LockConflictError (or one of its subclasses). Rather than failing the
+whole request, a block decorated with retry_on_conflict is run again after a
+jittered, exponentially growing pause:
+
+    from firebird.retry import retry_on_conflict
+
+    @retry_on_conflict(attempts=5)
+    def reserve(product, quantity):
+        stock = Stock.objects.get(product=product)
+        stock.quantity -= quantity
+        stock.save()
+
+The backend runs its transactions in snapshot (concurrency) isolation: a row
+updated by a transaction that committed after ours started raises an
+UpdateConflictError every time it is touched again in the same transaction.
+How a conflict is retried therefore depends on who owns the transaction:
+
+* Outside of transaction management, the block gets a transaction of its
+  own, committed when it returns. On any LockConflictError the whole
+  transaction is rolled back and the block runs again in a new one, with a
+  new snapshot.
+* Inside a managed transaction (commit_on_success, commit_manually...) only
+  the block is undone, by rolling back to a savepoint taken before it. That
+  helps with lock conflicts and deadlocks against transactions that have not
+  committed, so those are retried. An UpdateConflictError can't be fixed in
+  the current snapshot and is raised at once: retry the transaction at the
+  level that owns it.
+
+Only the decorated block is replayed, so it must not have side effects
+outside the database. The defaults of a database alias can be set with the
+CONFLICT_RETRY key of settings.DATABASES:
+
+    'CONFLICT_RETRY': {'ATTEMPTS': 5, 'BACKOFF': 0.05, 'MAX_BACKOFF': 1.0}
+"""
+import random
+import sys
+import time
+
+try:
+    from functools import wraps
+except ImportError:
+    from django.utils.functional import wraps
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from firebird.backend import metrics
+from firebird.backend.base import LockConflictError, UpdateConflictError
+
+DEFAULTS = {
+    'ATTEMPTS': 3,
+    'BACKOFF': 0.05,
+    'MAX_BACKOFF': 1.0,
+}
+
+class RetryPolicy(object):
+    """
+    Runs a callable, retrying it up to ``attempts`` times in all when it
+    raises a LockConflictError, see the module documentation for which
+    conflicts are retried. The pause before retry n is drawn uniformly between
+    0 and min(max_backoff, backoff * 2 ** n) seconds.
+    """
+    def __init__(self, attempts=None, backoff=None, max_backoff=None, using=None):
+        if using is None:
+            using = DEFAULT_DB_ALIAS
+        options = dict(DEFAULTS)
+        options.update(connections[using].settings_dict.get('CONFLICT_RETRY', {}))
+        if attempts is None:
+            attempts = options['ATTEMPTS']
+        if backoff is None:
+            backoff = options['BACKOFF']
+        if max_backoff is None:
+            max_backoff = options['MAX_BACKOFF']
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.using = using
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def run(self, func, *args, **kwargs):
+        if transaction.is_managed(using=self.using):
+            return self._run_in_savepoint(func, args, kwargs)
+        return self._run_in_transaction(func, args, kwargs)
+
+    def _wait(self, attempt, e):
+        metrics.conflict_retries.inc((self.using, e.__class__.__name__))
+        time.sleep(self.delay(attempt - 1))
+
+    def _run_in_transaction(self, func, args, kwargs):
+        using = self.using
+        # Start from a new snapshot, not one left open by earlier reads
+        transaction.commit_unless_managed(using=using)
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = func(*args, **kwargs)
+                except LockConflictError, e:
+                    exc_info = sys.exc_info()
+                    transaction.rollback(using=using)
+                    attempt += 1
+                    if attempt >= self.attempts:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    self._wait(attempt, e)
+                except:
+                    exc_info = sys.exc_info()
+                    transaction.rollback(using=using)
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                else:
+                    transaction.commit(using=using)
+                    return result
+        finally:
+            transaction.leave_transaction_management(using=using)
+
+    def _run_in_savepoint(self, func, args, kwargs):
+        using = self.using
+        attempt = 0
+        while True:
+            sid = transaction.savepoint(using=using)
+            try:
+                result = func(*args, **kwargs)
+            except LockConflictError, e:
+                exc_info = sys.exc_info()
+                transaction.savepoint_rollback(sid, using=using)
+                attempt += 1
+                # The snapshot of the transaction would conflict again
+                if isinstance(e, UpdateConflictError) or attempt >= self.attempts:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self._wait(attempt, e)
+            except:
+                exc_info = sys.exc_info()
+                transaction.savepoint_rollback(sid, using=using)
+                raise exc_info[0], exc_info[1], exc_info[2]
+            else:
+                transaction.savepoint_commit(sid, using=using)
+                return result
+
+    def __call__(self, func):
+        def inner(*args, **kwargs):
+            return self.run(func, *args, **kwargs)
+        return wraps(func)(inner)
+
+def retry_on_conflict(attempts=None, backoff=None, max_backoff=None, using=None):
+    "Decorator retrying the decorated function on conflicts, see RetryPolicy."
+    return RetryPolicy(attempts, backoff, max_backoff, using)
@@ -1,23 +1,762 @@
 """
-This file demonstrates two different styles of tests (one doctest and one
-unittest). These will both pass when you run "manage.py test".
-
-Replace these with more appropriate tests for your application.
+Tests of the firebird package. They run on the fake kinterbasdb connections
+of firebird.benchmarks.fakedb and don't need a Firebird server.
 """
+import cPickle
+import datetime
+import marshal
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.core.management.base import CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from firebird import columnar, parallel
+from firebird.backend import metrics
+from firebird.backend.base import (Database, DatabaseError, DeadlockError,
+    FirebirdCursorWrapper, IntegrityError, LockConflictError, TypeTranslator,
+    UpdateConflictError, get_conflict_error_class, parse_error)
+from firebird.benchmarks import fakedb
+from firebird.management import dumpfile
+from firebird.management.commands import firebirddump, firebirdload
+from firebird.plans import Access, CapturedStatement, PlanCapture, capture_plans, parse_plan
+from firebird.retry import RetryPolicy, retry_on_conflict
+
+class PlanParsingTest(unittest.TestCase):
+    def test_natural_and_index(self):
+        self.assertEqual(parse_plan('PLAN JOIN (A NATURAL, "B" INDEX (RDB$PRIMARY1, B_IDX))'), [
+            Access('A', 'NATURAL'),
+            Access('B', 'INDEX', ['RDB$PRIMARY1', 'B_IDX']),
+        ])
+
+    def test_order(self):
+        self.assertEqual(parse_plan('PLAN SORT (T ORDER T_IDX INDEX (T_FK))\nPLAN (U ORDER U_IDX)'), [
+            Access('T', 'ORDER', ['T_IDX', 'T_FK']),
+            Access('U', 'ORDER', ['U_IDX']),
+        ])
+
+SELECT_ONE = 'SELECT "ID" FROM "ONE"'
+SELECT_TWO = 'SELECT "ID" FROM "TWO"'
+
+def make_recordings():
+    return dict([(recording.sql, recording) for recording in [
+        fakedb.Recording(SELECT_ONE, [('ID', 'INTEGER', 0)], [(1,), (2,)]),
+        fakedb.Recording(SELECT_TWO, [('ID', 'INTEGER', 0)], [(3,)]),
+    ]])
+
+def make_cursor(connection, alias='fake'):
+    "A FirebirdCursorWrapper around a cursor of a fake connection."
+    translator = TypeTranslator(alias)
+    translator.set_charset(connection.charset)
+    return FirebirdCursorWrapper(connection.cursor(), translator, alias)
+
+class PlanCaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'plans.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def capture(self, *plans):
+        capture = PlanCapture()
+        capture.statements = [CapturedStatement(SELECT_ONE, plan) for plan in plans]
+        return capture
+
+    def test_capture(self):
+        cursor = make_cursor(fakedb.Connection(make_recordings(), plans={
+            SELECT_ONE: 'PLAN (ONE NATURAL)',
+            'DROP TABLE "ONE"': Database.ProgrammingError(
+                "(-607, 'isc_dsql_prepare: \\n  unsuccessful metadata update')"),
+        }))
+        plans = capture_plans()
+        plans.__enter__()
+        try:
+            cursor.execute(SELECT_ONE)
+            # Not preparable a second time, the statement still succeeds
+            cursor.execute('DROP TABLE "ONE"')
+        finally:
+            plans.__exit__(None, None, None)
+        self.assertEqual([(s.sql, s.plan) for s in plans.statements],
+            [(SELECT_ONE, 'PLAN (ONE NATURAL)'), ('DROP TABLE "ONE"', '')])
+        self.assertRaises(AssertionError, plans.assert_index_used, 'ONE')
+        self.assertRaises(AssertionError, plans.assert_no_natural_scan)
+        self.assertFalse(plans.observe in FirebirdCursorWrapper.statement_observers)
+
+    def test_baseline(self):
+        # A missing name is written
+        self.capture('PLAN (ONE NATURAL)').assert_matches_baseline(self.path, 'one', False)
+        self.capture('PLAN (ONE NATURAL)').assert_matches_baseline(self.path, 'one', False)
+        self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline(self.path, 'two', False)
+        self.assertRaises(AssertionError,
+            self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline, self.path, 'one', False)
+        # Updating accepts the new plan
+        self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline(self.path, 'one', True)
+        self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline(self.path, 'one', False)
+        self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline(self.path, 'two', False)
+
+    def test_baseline_update_environ(self):
+        self.capture('PLAN (ONE NATURAL)').assert_matches_baseline(self.path, 'one')
+        os.environ['FIREBIRD_UPDATE_PLANS'] = '1'
+        try:
+            self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline(self.path, 'one')
+        finally:
+            del os.environ['FIREBIRD_UPDATE_PLANS']
+        self.capture('PLAN (ONE INDEX (PK))').assert_matches_baseline(self.path, 'one')
+        self.assertRaises(AssertionError,
+            self.capture('PLAN (ONE NATURAL)').assert_matches_baseline, self.path, 'one')
+
+class FakePool(parallel.ConnectionPool):
+    def connect(self):
+        return fakedb.Connection(make_recordings())
+
+class FakeQuerySet(object):
+    "Just what evaluate() needs of a queryset."
+    db = DEFAULT_DB_ALIAS
+
+    def __init__(self, sql, delay=0, error=None):
+        self.sql = sql
+        self.delay = delay
+        self.error = error
+
+    def all(self):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        cursor = connections[self.db].cursor()
+        cursor.execute(self.sql)
+        return cursor.fetchall()
+
+class ParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.pools = parallel._pools.copy()
+        self.set_pool_size(4)
+
+    def tearDown(self):
+        parallel._pools.clear()
+        parallel._pools.update(self.pools)
+
+    def set_pool_size(self, size):
+        self.pool = parallel._pools[DEFAULT_DB_ALIAS] = FakePool(DEFAULT_DB_ALIAS, size)
+
+    def test_order(self):
+        results = parallel.evaluate([
+            FakeQuerySet(SELECT_ONE, delay=0.1),
+            FakeQuerySet(SELECT_TWO),
+            FakeQuerySet(SELECT_ONE, delay=0.05),
+        ])
+        self.assertEqual([result.get() for result in results], [[(1,), (2,)], [(3,)], [(1,), (2,)]])
+        self.assertTrue(results[0].ok)
+
+    def test_error(self):
+        results = parallel.evaluate([
+            FakeQuerySet(SELECT_ONE),
+            FakeQuerySet(SELECT_ONE, error=ValueError('broken')),
+        ])
+        self.assertTrue(results[0].ok)
+        self.assertFalse(results[1].ok)
+        self.assertFalse(results[1].timed_out)
+        self.assertTrue(isinstance(results[1].error, ValueError))
+        self.assertRaises(ValueError, results[1].get)
+
+    def test_timeout(self):
+        # A single attachment, the queries run one after the other
+        self.set_pool_size(1)
+        results = parallel.evaluate([FakeQuerySet(SELECT_ONE, delay=0.2) for i in range(3)],
+            timeout=0.3)
+        self.assertEqual(results[0].get(), [(1,), (2,)])
+        for result in results[1:]:
+            self.assertTrue(result.timed_out)
+            self.assertRaises(parallel.QueryTimeout, result.get)
+
+    def test_conflict_keeps_attachment(self):
+        error = UpdateConflictError("(-913, 'isc_dsql_execute: \\n  deadlock\\n  update conflicts with concurrent update')")
+        results = parallel.evaluate([FakeQuerySet(SELECT_ONE, error=error)])
+        self.assertTrue(isinstance(results[0].error, UpdateConflictError))
+        self.assertEqual((len(self.pool._idle), self.pool._opened), (1, 1))
+
+    def test_connection_error_discards_attachment(self):
+        error = Database.OperationalError("(-902, 'isc_dsql_fetch: \\n  connection shutdown')")
+        results = parallel.evaluate([FakeQuerySet(SELECT_ONE, error=error)])
+        self.assertFalse(results[0].ok)
+        self.assertEqual((len(self.pool._idle), self.pool._opened), (0, 0))
+
+SELECT_PRICES = 'SELECT "ID", "PRICE", "DAY", "CREATED" FROM "PRICES"'
+
+class ColumnarTest(unittest.TestCase):
+    def fetch(self, rows, **kwargs):
+        recording = fakedb.Recording(SELECT_PRICES, [('ID', 'INTEGER', 0), ('PRICE', 'FIXED', 2),
+            ('DAY', 'DATE', 0), ('CREATED', 'TIMESTAMP', 0)], rows)
+        self.connection = fakedb.Connection({recording.sql: recording}, log=True)
+        kwargs.setdefault('use_numpy', False)
+        return columnar.fetch_columns(make_cursor(self.connection), SELECT_PRICES, **kwargs)
+
+    def test_kinds(self):
+        columns = self.fetch([
+            (1, 1050, (1970, 1, 2), (1970, 1, 1, 0, 0, 1, 500000)),
+            (2, -25, (1969, 12, 31), (1970, 1, 2, 1, 2, 3, 0)),
+        ])
+        ids, prices, days, created = columns
+        self.assertEqual(columns.names, ['ID', 'PRICE', 'DAY', 'CREATED'])
+        self.assertEqual(columns.scales, [0, 2, 0, 0])
+        self.assertEqual((ids.typecode, list(ids)), (columnar.INT64, [1, 2]))
+        self.assertEqual(list(prices), [1050, -25])
+        self.assertEqual(list(days), [1, -1])
+        self.assertEqual(list(created), [1500000, 86400000000 + 3723000000])
+
+    def test_timestamp_tuples(self):
+        # Microseconds apart (kinterbasdb 3.2 and later) or fractional seconds
+        self.assertEqual(columnar.timestamp_conv_out((1970, 1, 2, 1, 2, 3, 250000)),
+            86400000000 + 3723250000)
+        self.assertEqual(columnar.timestamp_conv_out((1970, 1, 2, 1, 2, 3.25)),
+            86400000000 + 3723250000)
+
+    def test_float_decimals(self):
+        ids, prices, days, created = self.fetch([(1, 1050, None, None)], decimals='float')
+        self.assertEqual((prices.typecode, list(prices)), ('d', [10.5]))
+        self.assertRaises(ValueError, self.fetch, [], decimals='fixed')
+
+    def test_nulls(self):
+        ids, prices, days, created = self.fetch([
+            (1, None, (1970, 1, 1), None),
+            (None, 100, None, (1970, 1, 1, 0, 0, 0, 0)),
+        ])
+        # The integer column is promoted to float
+        self.assertEqual(ids.typecode, 'd')
+        self.assertEqual(ids[0], 1.0)
+        self.assertTrue(ids[1] != ids[1])
+        self.assertTrue(prices[0] != prices[0])
+        self.assertEqual(prices[1], 100)
+        self.assertEqual(list(days), [0, columnar.NAT])
+        self.assertEqual(list(created), [columnar.NAT, 0])
+
+    def test_chunks(self):
+        rows = [(i, i, (1970, 1, 1), None) for i in range(5)]
+        rows[3] = (None, 3, None, None)
+        ids, prices, days, created = self.fetch(rows, chunk_size=2)
+        self.assertEqual(self.connection.fetches, [2, 2, 2, 2])
+        self.assertEqual(list(ids[:3]) + list(ids[4:]), [0.0, 1.0, 2.0, 4.0])
+        self.assertTrue(ids[3] != ids[3])
+        self.assertEqual(list(prices), range(5))
+
+    def test_translations_restored(self):
+        self.fetch([])
+        cursor = make_cursor(self.connection)
+        columnar.fetch_columns(cursor, SELECT_PRICES, use_numpy=False)
+        cursor.execute(SELECT_PRICES)
+        self.assertEqual(cursor.cursor._trans_out, cursor.type_translator.type_translate_out)
+
+    def test_mismatch(self):
+        column = columnar.Column('PRICE', 'int')
+        self.assertRaises(TypeError, column.extend, (None, Decimal('1.5')))
+        self.assertRaises(TypeError, column.extend, (Decimal('1.5'),))
+        self.assertEqual(len(column.data), 0)
+
+    def test_numpy(self):
+        if columnar.numpy is None:
+            return
+        ids, prices, days, created = self.fetch([(1, 1050, (1970, 1, 2), None)], use_numpy=True)
+        self.assertEqual(str(ids.dtype), 'int64')
+        self.assertEqual(str(days.dtype), 'datetime64[D]')
+        self.assertEqual(str(created[0]), 'NaT')
+
+DUMP_COLUMNS = ['ID', 'NAME', 'PRICE', 'DAY', 'CREATED']
+DUMP_ROWS = [
+    [1, u'caf\xe9', Decimal('1.50'), datetime.date(2020, 1, 2),
+        datetime.datetime(2020, 1, 2, 3, 4, 5, 600000)],
+    [2, u'\\N', None, None, datetime.datetime(2020, 1, 2, 3, 4, 5)],
+    [3, u'', Decimal('-2'), datetime.date(1999, 12, 31), None],
+    [4, u'\\\\ "quoted", and\nnew line', Decimal('0.001'), None, None],
+]
+
+class DumpFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, format, path):
+        writer = dumpfile.get_writer(format, path, ['ONE', 'TWO'])
+        writer.start_table('ONE', DUMP_COLUMNS)
+        writer.write_rows(DUMP_ROWS[:3])
+        writer.write_rows(DUMP_ROWS[3:])
+        writer.end_table()
+        writer.start_table('TWO', ['ID'])
+        writer.end_table()
+        writer.close()
+
+    def read(self, reader):
+        tables = []
+        try:
+            for table, columns, batches in reader:
+                rows = []
+                for batch in batches:
+                    rows.extend(batch)
+                tables.append((table, columns, rows))
+        finally:
+            reader.close()
+        return tables
+
+    def test_binary(self):
+        for name in ('dump', 'dump.gz'):
+            path = os.path.join(self.directory, name)
+            self.write('binary', path)
+            reader = dumpfile.get_reader('binary', path, 2)
+            self.assertEqual(reader.tables, ['ONE', 'TWO'])
+            self.assertEqual(self.read(reader),
+                [('ONE', DUMP_COLUMNS, DUMP_ROWS), ('TWO', ['ID'], [])])
+
+    def test_binary_skip_table(self):
+        path = os.path.join(self.directory, 'dump')
+        self.write('binary', path)
+        reader = dumpfile.get_reader('binary', path, 2)
+        self.assertEqual([table for table, columns, batches in reader], ['ONE', 'TWO'])
+        reader.close()
+
+    def test_binary_values(self):
+        path = os.path.join(self.directory, 'dump')
+        rows = [[2 ** 70, 1.5, 'blob \x00\xff', datetime.time(12, 30, 0, 250000)]]
+        writer = dumpfile.get_writer('binary', path, ['ONE'])
+        writer.start_table('ONE', ['A', 'B', 'C', 'D'])
+        writer.write_rows(rows)
+        writer.end_table()
+        writer.close()
+        self.assertEqual(self.read(dumpfile.get_reader('binary', path, 2)),
+            [('ONE', ['A', 'B', 'C', 'D'], rows)])
+
+    def test_binary_rejects_pickle(self):
+        path = os.path.join(self.directory, 'dump')
+        stream = open(path, 'wb')
+        cPickle.dump(('tables', ['ONE']), stream)
+        stream.close()
+        self.assertRaises(ValueError, dumpfile.get_reader, 'binary', path, 2)
+
+    def test_binary_unknown_value(self):
+        path = os.path.join(self.directory, 'dump')
+        stream = open(path, 'wb')
+        stream.write(dumpfile.MAGIC)
+        for record in [('tables', ['ONE']), ('table', 'ONE', ['A']),
+                ('rows', [[('os.system', 'true')]])]:
+            data = marshal.dumps(record)
+            stream.write(dumpfile._LENGTH.pack(len(data)) + data)
+        stream.close()
+        reader = dumpfile.get_reader('binary', path, 2)
+        self.assertRaises(ValueError, self.read, reader)
+
+    def test_csv(self):
+        path = os.path.join(self.directory, 'dump')
+        self.write('csv', path)
+        reader = dumpfile.get_reader('csv', path, 3)
+        self.assertEqual(reader.tables, ['ONE', 'TWO'])
+        tables = self.read(reader)
+        self.assertEqual([(table, columns) for table, columns, rows in tables],
+            [('ONE', DUMP_COLUMNS), ('TWO', ['ID'])])
+        rows = dumpfile.parse_rows(tables[0][2], [int, None, Decimal,
+            dumpfile.CSV_PARSERS['DateField'], dumpfile.CSV_PARSERS['DateTimeField']])
+        self.assertEqual(rows, DUMP_ROWS)
+        self.assertEqual(tables[1][2], [])
+
+    def test_parse_rows(self):
+        self.assertEqual(dumpfile.parse_rows([[u'1', None, u'1.5', u'12:30:00.250000']],
+            [int, float, float, dumpfile.CSV_PARSERS['TimeField']]),
+            [[1, None, 1.5, datetime.time(12, 30, 0, 250000)]])
+
+def _name(name, length=31):
+    "A CHAR value of the system tables, padded like Firebird returns it."
+    return name.ljust(length)
+
+NAME = ('RDB$NAME', 'TEXT', 0)
+RULE = ('RDB$RULE', 'TEXT', 0)
+NUMBER = ('RDB$NUMBER', 'INTEGER', 0)
+NODE_COLUMNS = ['ID', 'PARENT_ID', 'LABEL', 'UPPER_LABEL']
+# Children come before their parent, as a table scan may return them
+NODE_ROWS = [[2, 1, u'b', u'B'], [1, None, u'a', u'A']]
+
+class CommandTest(unittest.TestCase):
+    """
+    firebirddump and firebirdload on NODE, which references itself and has
+    a COMPUTED BY column, and LEAF, which references NODE.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dump')
+        self.wrapper = connections[DEFAULT_DB_ALIAS]
+        self.saved_connection = self.wrapper.connection
+        self.recordings = {}
+        self.labels = {}
+        self.connection = fakedb.Connection(self.recordings, log=True)
+        self.wrapper.connection = self.connection
+        # What _cursor() does when it connects
+        self.wrapper._type_translator.set_charset(self.connection.charset)
+
+        self.record([NAME], [(_name('LEAF'),), (_name('NODE'),)], 'get_table_list')
+        self.record([NUMBER, NUMBER, NAME], [(1, 0, _name('NODE'))], 'get_relations', 'NODE')
+        self.record([NUMBER, NUMBER, NAME], [(1, 0, _name('NODE'))], 'get_relations', 'LEAF')
+        self.record([NAME] + [NUMBER] * 5, [(_name(column), 8, 4, 0, 0, None)
+            for column in NODE_COLUMNS], 'get_table_description', 'NODE')
+        self.record([NAME], [(_name('UPPER_LABEL'),)], 'get_computed_columns', 'NODE')
+        self.record([NAME], [], 'get_computed_columns', 'LEAF')
+        self.record([NAME], [(_name('NODE_TR'),)], 'get_triggers', 'NODE')
+        self.record([NAME], [], 'get_triggers', 'LEAF')
+        self.record([NAME], [(_name('NODE_LABEL'),)], 'get_plain_indexes', 'NODE')
+        self.record([NAME], [], 'get_plain_indexes', 'LEAF')
+        self.record([NAME, NAME, NAME, NAME, RULE, RULE], [(_name('NODE_PARENT'),
+            _name('PARENT_ID'), _name('NODE'), _name('ID'), _name('RESTRICT', 11),
+            _name('CASCADE', 11))], 'get_foreign_keys', 'NODE')
+        self.record([NAME, NAME, NAME, NAME, RULE, RULE], [(_name('LEAF_NODE'),
+            _name('NODE_ID'), _name('NODE'), _name('ID'), _name('RESTRICT', 11),
+            _name('RESTRICT', 11))], 'get_foreign_keys', 'LEAF')
+        self.record([NAME, NAME], [(_name('ID'), _name('PRIMARY KEY', 11))], 'get_indexes', 'NODE')
+        for sql, rows in [
+                ('SELECT "ID", "PARENT_ID", "LABEL" FROM "NODE"', [row[:3] for row in NODE_ROWS]),
+                (GENERATOR % 'NODE_GN', [(1,)]),
+                (GENERATOR % 'LEAF_GN', []),
+                ('SELECT MAX("ID") FROM "NODE"', [(2,)])]:
+            columns = [('C%d' % i, 'INTEGER', 0) for i in range(len(rows and rows[0]))]
+            self.recordings[sql] = fakedb.Recording(sql, columns, rows)
+
+    def tearDown(self):
+        self.wrapper.connection = self.saved_connection
+        shutil.rmtree(self.directory)
+
+    def record(self, columns, rows, method, *args):
+        "Records the result of an introspection method, logged as 'method args'."
+        introspection = self.wrapper.introspection
+        (sql,) = fakedb.capture_statements(
+            lambda cursor: getattr(introspection, method)(cursor, *args))
+        recording = fakedb.Recording(sql, columns, rows)
+        self.recordings[recording.sql] = recording
+        self.labels[recording.sql] = ' '.join((method,) + args)
+
+    def log(self):
+        return [self.labels.get(sql, sql) for sql in self.connection.statements]
+
+    def write_dump(self):
+        writer = dumpfile.get_writer('binary', self.path, ['NODE', 'LEAF'])
+        writer.start_table('NODE', NODE_COLUMNS)
+        writer.write_rows(NODE_ROWS)
+        writer.end_table()
+        writer.start_table('LEAF', ['ID', 'NODE_ID'])
+        writer.write_rows([[1, 2]])
+        writer.end_table()
+        writer.close()
+
+    def test_introspection(self):
+        introspection = self.wrapper.introspection
+        cursor = self.wrapper.cursor()
+        self.assertEqual(introspection.get_triggers(cursor, 'NODE'), ['NODE_TR'])
+        self.assertEqual(introspection.get_plain_indexes(cursor, 'NODE'), ['NODE_LABEL'])
+        self.assertEqual(introspection.get_computed_columns(cursor, 'NODE'), ['UPPER_LABEL'])
+        self.assertEqual(introspection.get_foreign_keys(cursor, 'NODE'),
+            [('NODE_PARENT', ['PARENT_ID'], 'NODE', ['ID'], None, 'CASCADE')])
+
+    def test_compound_foreign_key(self):
+        self.record([NAME, NAME, NAME, NAME, RULE, RULE], [
+            (_name('A_B'), _name('B1'), _name('B'), _name('ID1'), _name('CASCADE', 11), None),
+            (_name('A_B'), _name('B2'), _name('B'), _name('ID2'), _name('CASCADE', 11), None),
+            (_name('A_C'), _name('C'), _name('C'), _name('ID'), None, _name('SET NULL', 11)),
+        ], 'get_foreign_keys', 'A')
+        self.assertEqual(self.wrapper.introspection.get_foreign_keys(self.wrapper.cursor(), 'A'), [
+            ('A_B', ['B1', 'B2'], 'B', ['ID1', 'ID2'], 'CASCADE', None),
+            ('A_C', ['C'], 'C', ['ID'], None, 'SET NULL'),
+        ])
+
+    def test_sort_tables(self):
+        self.record([NUMBER, NUMBER, NAME], [(0, 0, _name('B'))], 'get_relations', 'A')
+        self.record([NUMBER, NUMBER, NAME], [(0, 0, _name('A'))], 'get_relations', 'B')
+        tables = firebirddump.Command().sort_tables(self.wrapper, self.wrapper.cursor(),
+            ['LEAF', 'A', 'NODE', 'B'])
+        # NODE only references itself, A and B reference each other
+        self.assertEqual(tables, ['NODE', 'LEAF', 'A', 'B'])
+
+    def test_dump(self):
+        firebirddump.Command().handle('NODE', output=self.path, verbosity=0)
+        self.assertEqual(self.log(), ['get_table_list', 'get_relations NODE',
+            'get_computed_columns NODE', 'get_table_description NODE',
+            'SELECT "ID", "PARENT_ID", "LABEL" FROM "NODE"'])
+        reader = dumpfile.get_reader('binary', self.path, 1000)
+        self.assertEqual([(table, columns, list(batches)) for table, columns, batches in reader],
+            [('NODE', ['ID', 'PARENT_ID', 'LABEL'], [[[2, 1, u'b'], [1, None, u'a']]])])
+        reader.close()
+
+    def test_load(self):
+        self.write_dump()
+        firebirdload.Command().handle(self.path, truncate=True, verbosity=0)
+        self.assertEqual(self.log(), ['COMMIT',
+            'get_foreign_keys NODE', 'get_foreign_keys LEAF',
+            'ALTER TABLE "NODE" DROP CONSTRAINT "NODE_PARENT"',
+            'ALTER TABLE "LEAF" DROP CONSTRAINT "LEAF_NODE"', 'COMMIT',
+            'DELETE FROM "NODE"', 'DELETE FROM "LEAF"', 'COMMIT',
+            # UPPER_LABEL is left out
+            'get_triggers NODE', 'get_plain_indexes NODE', 'get_computed_columns NODE',
+            'ALTER TRIGGER "NODE_TR" INACTIVE', 'ALTER INDEX "NODE_LABEL" INACTIVE', 'COMMIT',
+            'INSERT INTO "NODE" ("ID", "PARENT_ID", "LABEL") VALUES (?, ?, ?)', 'COMMIT',
+            'ROLLBACK', 'ALTER INDEX "NODE_LABEL" ACTIVE', 'ALTER TRIGGER "NODE_TR" ACTIVE',
+            'COMMIT', GENERATOR % 'NODE_GN', 'get_indexes NODE', 'SELECT MAX("ID") FROM "NODE"',
+            'SET GENERATOR "NODE_GN" TO 2', 'COMMIT',
+            'get_triggers LEAF', 'get_plain_indexes LEAF', 'get_computed_columns LEAF', 'COMMIT',
+            'INSERT INTO "LEAF" ("ID", "NODE_ID") VALUES (?, ?)', 'COMMIT',
+            'ROLLBACK', 'COMMIT', GENERATOR % 'LEAF_GN',
+            'ROLLBACK', NODE_PARENT_SQL, 'COMMIT', LEAF_NODE_SQL, 'COMMIT', 'ROLLBACK'])
+        self.assertFalse(transaction.is_managed())
+
+    def test_load_broken_foreign_key(self):
+        self.write_dump()
+        self.connection.errors[NODE_PARENT_SQL] = Database.ProgrammingError(
+            "(-607, 'isc_dsql_execute: \\n  violation of FOREIGN KEY constraint')")
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertRaises(CommandError, firebirdload.Command().handle, self.path, verbosity=0)
+            self.assertTrue('NODE_PARENT' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+        # The other key is still created
+        self.assertEqual(self.log()[-7:], [GENERATOR % 'LEAF_GN', 'ROLLBACK',
+            NODE_PARENT_SQL, 'ROLLBACK', LEAF_NODE_SQL, 'COMMIT', 'ROLLBACK'])
+
+GENERATOR = "select 1 from rdb$generators where rdb$generator_name = '%s'"
+NODE_PARENT_SQL = ('ALTER TABLE "NODE" ADD CONSTRAINT "NODE_PARENT" FOREIGN KEY ("PARENT_ID") '
+    'REFERENCES "NODE" ("ID") ON DELETE CASCADE')
+LEAF_NODE_SQL = ('ALTER TABLE "LEAF" ADD CONSTRAINT "LEAF_NODE" FOREIGN KEY ("NODE_ID") '
+    'REFERENCES "NODE" ("ID")')
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.counter = self.registry.counter('test_bytes_total', 'Bytes.')
+        self.histogram = self.registry.histogram('test_seconds', 'Time.', ('alias', 'event'),
+            buckets=(0.1, 1.0))
+
+    def test_text(self):
+        self.counter.inc(('default',), 2 ** 63)
+        self.counter.inc(('other "db"',))
+        self.histogram.observe(('default', 'saved'), 0.05)
+        self.histogram.observe(('default', 'saved'), 0.5)
+        self.histogram.observe(('default', 'saved'), 5)
+        self.assertEqual(metrics.TextExporter().export(self.registry).splitlines(), [
+            '# HELP test_bytes_total Bytes.',
+            '# TYPE test_bytes_total counter',
+            'test_bytes_total{alias="default"} 9223372036854775808',
+            'test_bytes_total{alias="other \\"db\\""} 1',
+            '# HELP test_seconds Time.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{alias="default",event="saved",le="0.1"} 1',
+            'test_seconds_bucket{alias="default",event="saved",le="1.0"} 2',
+            'test_seconds_bucket{alias="default",event="saved",le="+Inf"} 3',
+            'test_seconds_sum{alias="default",event="saved"} 5.55',
+            'test_seconds_count{alias="default",event="saved"} 3',
+        ])
+
+    def test_snapshot(self):
+        self.counter.inc(('default',), 3)
+        self.histogram.observe(('default', 'saved'), 0.5)
+        self.assertEqual(metrics.SnapshotExporter().export(self.registry), {
+            'test_bytes_total': {'type': 'counter', 'help': 'Bytes.', 'samples': [
+                {'labels': {'alias': 'default'}, 'value': 3},
+            ]},
+            'test_seconds': {'type': 'histogram', 'help': 'Time.', 'samples': [
+                {'labels': {'alias': 'default', 'event': 'saved'}, 'value': {
+                    'buckets': [(0.1, 0), (1.0, 1), (float('inf'), 1)],
+                    'sum': 0.5, 'count': 1}},
+            ]},
+        })
+        self.registry.reset()
+        self.assertEqual(self.registry.snapshot()['test_bytes_total']['samples'], [])
+
+    def test_register_once(self):
+        self.assertTrue(self.registry.counter('test_bytes_total', 'Bytes.') is self.counter)
+        self.assertEqual(len(self.registry.metrics()), 2)
+
+def make_exc_info(error):
+    try:
+        raise error
+    except:
+        return sys.exc_info()
+
+UPDATE_CONFLICT = "(-913, 'isc_dsql_execute: \\n  deadlock\\n  update conflicts with concurrent update\\n  concurrent transaction number is 42')"
+DEADLOCK = "(-913, 'isc_dsql_execute: \\n  deadlock')"
+LOCK_CONFLICT = "(-901, 'isc_dsql_execute: \\n  lock conflict on no wait transaction')"
+DUPLICATE = "(-803, 'isc_dsql_execute: \\n  violation of PRIMARY or UNIQUE KEY constraint \"PK\" on table \"ONE\"')"
+
+class ErrorTest(unittest.TestCase):
+    def test_parse_error(self):
+        self.assertEqual(parse_error(Database.ProgrammingError(DEADLOCK)),
+            (-913, ['isc_dsql_execute: ', '  deadlock']))
+        self.assertEqual(parse_error(Database.ProgrammingError('no number')), (None, ['no number']))
+
+    def test_conflict_error_class(self):
+        for text, error_class in [(UPDATE_CONFLICT, UpdateConflictError),
+                (DEADLOCK, DeadlockError), (LOCK_CONFLICT, LockConflictError), (DUPLICATE, None)]:
+            err_no, lines = parse_error(Database.OperationalError(text))
+            self.assertEqual(get_conflict_error_class(err_no, '\n'.join(lines)), error_class)
+
+    def test_raise_error(self):
+        cursor = make_cursor(fakedb.Connection({}))
+        for error, error_class in [
+                (Database.ProgrammingError(DUPLICATE), IntegrityError),
+                (Database.OperationalError(UPDATE_CONFLICT), UpdateConflictError),
+                (Database.ProgrammingError(LOCK_CONFLICT), LockConflictError),
+                (Database.ProgrammingError("(-204, 'isc_dsql_prepare: \\n  Table unknown')"), DatabaseError)]:
+            try:
+                cursor.raise_error(make_exc_info(error), 'UPDATE "ONE" SET "ID" = ?', (1,))
+            except Exception, e:
+                self.assertEqual(e.__class__, error_class)
+                self.assertTrue('UPDATE "ONE" SET "ID" = ?' in str(e))
+            else:
+                self.fail('%s not raised' % error_class.__name__)
+        # Other errors are raised unchanged
+        error = Database.OperationalError("(-902, 'isc_dsql_fetch: \\n  connection shutdown')")
+        try:
+            cursor.raise_error(make_exc_info(error), 'SELECT 1 FROM RDB$DATABASE', ())
+        except Exception, e:
+            self.assertTrue(e is error)
+        else:
+            self.fail('OperationalError not raised')
+
+SELECT_NOTES = 'SELECT "ID", "NOTE" FROM "NOTES"'
+INSERT_NOTE = 'INSERT INTO "NOTES" ("ID", "NOTE") VALUES (%s, %s)'
+
+class BackendMetricsTest(unittest.TestCase):
+    alias = 'metrics'
+
+    def value(self, metric, *labels):
+        for sample_labels, value in metric.samples():
+            if sample_labels == (self.alias,) + labels:
+                return value
+        return 0
+
+    def test_statements(self):
+        recordings = dict([(recording.sql, recording) for recording in [
+            fakedb.Recording(SELECT_NOTES, [('ID', 'INTEGER', 0), ('NOTE', 'BLOB', 0)],
+                [(1, 'abc'), (2, 'de'), (3, None), (4, 'f')]),
+            fakedb.Recording(INSERT_NOTE % ('?', '?'), param_types=[('INTEGER', 0), ('BLOB', 0)]),
+        ]])
+        cursor = make_cursor(fakedb.Connection(recordings), self.alias)
+        cursor.execute(SELECT_NOTES)
+        cursor.fetchone()
+        cursor.fetchmany(2)
+        cursor.fetchall()
+        cursor.execute(SELECT_NOTES)
+        list(cursor)
+        cursor.executemany(INSERT_NOTE, [(5, u'g'), (6, u'h')])
+        try:
+            cursor.raise_error(make_exc_info(Database.ProgrammingError(DUPLICATE)), INSERT_NOTE, ())
+        except IntegrityError:
+            pass
+        self.assertEqual(self.value(metrics.statements, 'execute'), 2)
+        self.assertEqual(self.value(metrics.statements, 'executemany'), 1)
+        self.assertEqual(self.value(metrics.statement_seconds)['count'], 3)
+        self.assertEqual(self.value(metrics.rows_fetched), 8)
+        self.assertEqual(self.value(metrics.blob_bytes_decoded), 12)
+        self.assertEqual(self.value(metrics.statement_errors, -803), 1)
+        samples = metrics.registry.snapshot()['firebird_rows_fetched_total']['samples']
+        self.assertTrue({'labels': {'alias': self.alias}, 'value': 8} in samples)
+
+    def test_default_alias(self):
+        cursor = FirebirdCursorWrapper(fakedb.Connection({}).cursor(), TypeTranslator())
+        self.assertEqual((cursor.alias, cursor.type_translator.alias), (DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS))
+
+    def test_partial_iteration(self):
+        recording = fakedb.Recording(SELECT_NOTES, [('ID', 'INTEGER', 0), ('NOTE', 'BLOB', 0)],
+            [(1, None), (2, None), (3, None)])
+        self.alias = 'metrics_partial'
+        cursor = make_cursor(fakedb.Connection({recording.sql: recording}), self.alias)
+        cursor.execute(SELECT_NOTES)
+        rows = iter(cursor)
+        rows.next()
+        rows.next()
+        rows.close()
+        self.assertEqual(self.value(metrics.rows_fetched), 2)
+
+UPDATE_STOCK = 'UPDATE "STOCK" SET "QUANTITY" = 1'
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.wrapper = connections[DEFAULT_DB_ALIAS]
+        self.saved_connection = self.wrapper.connection
+        self.wrapper.connection = self.connection = fakedb.Connection({}, log=True)
+        self.calls = 0
+
+    def tearDown(self):
+        self.wrapper.connection = self.saved_connection
+
+    def log(self):
+        # Leave the savepoint names out, they depend on the thread
+        return [re.sub(r' "[^"]*"$', '', sql) for sql in self.connection.statements]
+
+    def update(self, failures, error_class=UpdateConflictError):
+        "Updates the stock, failing with a conflict the first ``failures`` times."
+        self.calls += 1
+        connections[DEFAULT_DB_ALIAS].cursor().execute(UPDATE_STOCK)
+        if self.calls <= failures:
+            raise error_class(UPDATE_CONFLICT)
+        return self.calls
+
+    def retries(self, error_class):
+        for labels, value in metrics.conflict_retries.samples():
+            if labels == (DEFAULT_DB_ALIAS, error_class.__name__):
+                return value
+        return 0
+
+    def test_transaction(self):
+        retries = self.retries(UpdateConflictError)
+        update = retry_on_conflict(attempts=3, backoff=0)(self.update)
+        self.assertEqual(update(2), 3)
+        self.assertEqual(self.log(), ['COMMIT',
+            UPDATE_STOCK, 'ROLLBACK', UPDATE_STOCK, 'ROLLBACK', UPDATE_STOCK, 'COMMIT'])
+        self.assertEqual(self.retries(UpdateConflictError), retries + 2)
+        self.assertFalse(transaction.is_managed())
+
+    def test_transaction_attempts(self):
+        policy = RetryPolicy(attempts=2, backoff=0)
+        self.assertRaises(UpdateConflictError, policy.run, self.update, 5)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.log(), ['COMMIT',
+            UPDATE_STOCK, 'ROLLBACK', UPDATE_STOCK, 'ROLLBACK'])
+        self.assertFalse(transaction.is_managed())
+
+    def test_transaction_other_error(self):
+        policy = RetryPolicy(attempts=3, backoff=0)
+        self.assertRaises(ValueError, policy.run, self.update, 1, ValueError)
+        self.assertEqual(self.log(), ['COMMIT', UPDATE_STOCK, 'ROLLBACK'])
 
-from django.test import TestCase
+    def run_managed(self, *args):
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            return RetryPolicy(attempts=3, backoff=0).run(self.update, *args)
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.failUnlessEqual(1 + 1, 2)
+    def test_savepoint(self):
+        self.assertEqual(self.run_managed(2, DeadlockError), 3)
+        self.assertEqual(self.log(), [
+            'SAVEPOINT', UPDATE_STOCK, 'ROLLBACK TO',
+            'SAVEPOINT', UPDATE_STOCK, 'ROLLBACK TO',
+            'SAVEPOINT', UPDATE_STOCK, 'RELEASE SAVEPOINT', 'ROLLBACK'])
 
-__test__ = {"doctest": """
-Another way to test that 1 + 1 is equal to 2.
+    def test_savepoint_attempts(self):
+        self.assertRaises(LockConflictError, self.run_managed, 5, LockConflictError)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.log(), ['SAVEPOINT', UPDATE_STOCK, 'ROLLBACK TO'] * 3 +
+            ['ROLLBACK'])
 
->>> 1 + 1 == 2
-True
-"""}
+    def test_savepoint_other_error(self):
+        self.assertRaises(ValueError, self.run_managed, 1, ValueError)
+        self.assertEqual(self.log(), ['SAVEPOINT', UPDATE_STOCK, 'ROLLBACK TO', 'ROLLBACK'])
 
+    def test_savepoint_update_conflict(self):
+        # The snapshot of the transaction would conflict again
+        self.assertRaises(UpdateConflictError, self.run_managed, 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.log(), ['SAVEPOINT', UPDATE_STOCK, 'ROLLBACK TO', 'ROLLBACK'])